@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import time
+import numpy as np
+import gym
+from optparse import OptionParser
+
+import gym_minigrid
+from gym_minigrid.vector import VecMiniGrid, SubprocVecEnv, ThreadVecEnv
+
+def bench_single(env_name, num_envs, num_steps):
+    env = gym.make(env_name)
+    env.reset()
+    actions = np.random.randint(0, env.action_space.n, size=num_steps * num_envs)
+
+    start = time.time()
+    for action in actions:
+        obs, reward, done, info = env.step(action)
+        if done:
+            env.reset()
+    return len(actions) / (time.time() - start)
+
+def bench_vec(vec_env, num_steps):
+    vec_env.reset()
+    num_actions = vec_env.single_action_space.n
+    actions = np.random.randint(0, num_actions, size=(num_steps, vec_env.num_envs))
+
+    start = time.time()
+    for step_actions in actions:
+        vec_env.step(step_actions)
+    fps = actions.size / (time.time() - start)
+
+    vec_env.close()
+    return fps
+
+def main():
+    parser = OptionParser()
+    parser.add_option(
+        "-e",
+        "--env-name",
+        dest="env_name",
+        help="gym environment to load",
+        default='MiniGrid-DoorKey-8x8-v0'
+    )
+    parser.add_option(
+        "-n",
+        "--num-envs",
+        dest="num_envs",
+        type="int",
+        help="number of environments stepped together",
+        default=64
+    )
+    parser.add_option(
+        "-s",
+        "--num-steps",
+        dest="num_steps",
+        type="int",
+        help="number of steps of each environment",
+        default=200
+    )
+    parser.add_option(
+        "-w",
+        "--num-workers",
+        dest="num_workers",
+        type="int",
+        help="number of worker processes or threads",
+        default=None
+    )
+    (options, args) = parser.parse_args()
+
+    env_name = options.env_name
+    num_envs = options.num_envs
+    num_steps = options.num_steps
+    num_workers = options.num_workers
+
+    print('%s, %d envs, %d steps' % (env_name, num_envs, num_steps))
+    print('single env: %.0f steps/s' % bench_single(env_name, num_envs, num_steps))
+
+    try:
+        vec_env = VecMiniGrid(env_name, num_envs)
+    except AssertionError:
+        print('VecMiniGrid: environment not supported')
+    else:
+        print('VecMiniGrid: %.0f steps/s' % bench_vec(vec_env, num_steps))
+
+    vec_env = ThreadVecEnv(env_name, num_envs, num_workers=num_workers)
+    print('ThreadVecEnv: %.0f steps/s' % bench_vec(vec_env, num_steps))
+
+    try:
+        vec_env = SubprocVecEnv(env_name, num_envs, num_workers=num_workers)
+    except ImportError:
+        print('SubprocVecEnv: requires Python 3.8 or later')
+    else:
+        print('SubprocVecEnv: %.0f steps/s' % bench_vec(vec_env, num_steps))
+
+if __name__ == "__main__":
+    main()
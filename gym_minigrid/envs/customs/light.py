@@ -22,9 +22,9 @@ class LightTestExpEnv(MiniGridEnv):
 
     # Goal is to turn on the light before reaching the goal
     def goal_enabled(self):
-        for element in self.grid.grid:
-            if element is not None and element.type == "lightsw" \
-                    and hasattr(element, 'is_on'):
+        for pos in self.grid.positions("lightsw"):
+            element = self.grid.get(*pos)
+            if hasattr(element, 'is_on'):
                 return element.is_on
         return False
 
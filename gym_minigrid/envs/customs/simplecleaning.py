@@ -44,11 +44,7 @@ class DirtWatLightEnv(MiniGridEnv):
 
     # Enables the goal only when the room has been completely cleaned
     def goal_enabled(self):
-        nodirt = True
-        for element in self.grid.grid:
-            if element is not None and element.type == "dirt":
-                nodirt = False
-        return nodirt
+        return self.grid.count("dirt") == 0
 
     def _gen_grid(self, width, height):
         # Create an empty grid
@@ -7,6 +7,8 @@ class DynamicObstaclesEnv(MiniGridEnv):
     Single-room square grid environment with moving obstacles
     """
 
+    state_attrs = MiniGridEnv.state_attrs + ('obstacles',)
+
     def __init__(
             self,
             size=8,
@@ -74,6 +76,11 @@ class DynamicObstaclesEnv(MiniGridEnv):
             done = True
             return obs, reward, done, info
 
+        # The observation is the view before the obstacles move, unless
+        # step_many discards it
+        if isinstance(obs, LazyObs) and (done or not self.discard_obs):
+            obs.materialize()
+
         # Update obstacle positions
         for i_obst in range(len(self.obstacles)):
             old_pos = self.obstacles[i_obst].cur_pos
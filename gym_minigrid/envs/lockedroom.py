@@ -28,6 +28,9 @@ class LockedRoom(MiniGridEnv):
     named using an English text string
     """
 
+    state_attrs = MiniGridEnv.state_attrs + ('rooms',)
+    state_classes = MiniGridEnv.state_classes + (Room,)
+
     def __init__(
         self,
         size=19
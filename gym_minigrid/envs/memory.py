@@ -11,6 +11,8 @@ class MemoryEnv(MiniGridEnv):
     object at split.
     """
 
+    state_attrs = MiniGridEnv.state_attrs + ('success_pos', 'failure_pos')
+
     def __init__(
         self,
         seed,
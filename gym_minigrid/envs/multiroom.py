@@ -13,11 +13,91 @@ class Room:
         self.entryDoorPos = entryDoorPos
         self.exitDoorPos = exitDoorPos
 
+# Walls an exit door can be placed on, by wall of the entry door
+EXIT_WALLS = {
+    entryWall: tuple(wall for wall in range(0, 4) if wall != entryWall)
+    for entryWall in range(0, 4)
+}
+
+# Rooms a door can lead to, by maximum room size, see _roomTemplates
+_room_templates = {}
+
+def _roomTemplates(maxSz):
+    """
+    Get the rooms a door can lead to, by wall of the door in the room it
+    exits. Rooms are given as bounds (x0, y0, x1, y1), with x in [x0, x1[
+    and y in [y0, y1[, relative to the door. There is one room for every
+    size and every position of the door along its entry wall, except the
+    corners. The smallest rooms come first.
+    """
+
+    templates = _room_templates.get(maxSz)
+    if templates is not None:
+        return templates
+
+    templates = []
+    for wall in range(0, 4):
+        rooms = []
+        for sizeX in range(4, maxSz+1):
+            for sizeY in range(4, maxSz+1):
+                alongY = wall % 2 == 0
+                for k in range(0, (sizeY if alongY else sizeX) - 2):
+                    # Exit on the right wall
+                    if wall == 0:
+                        x0, y0 = 0, 2 - sizeY + k
+                    # Exit on the south wall
+                    elif wall == 1:
+                        x0, y0 = 2 - sizeX + k, 0
+                    # Exit on the left wall
+                    elif wall == 2:
+                        x0, y0 = 1 - sizeX, 2 - sizeY + k
+                    # Exit on the north wall
+                    else:
+                        x0, y0 = 2 - sizeX + k, 1 - sizeY
+                    rooms.append((x0, y0, x0 + sizeX, y0 + sizeY))
+        templates.append(rooms)
+
+    _room_templates[maxSz] = templates
+    return templates
+
+def _fitsIn(occupied, x0, y0, x1, y1):
+    """
+    Check that a room is inside the grid and does not overlap occupied
+    cells, given the occupancy as one bitmask of the y coordinates per x
+    """
+
+    if x0 < 0 or y0 < 0 or x1 > len(occupied) or y1 > occupied.height:
+        return False
+
+    mask = ((1 << (y1 - y0)) - 1) << y0
+    for x in range(x0, x1):
+        if occupied[x] & mask:
+            return False
+
+    return True
+
+class _Occupancy(list):
+    """
+    Occupancy bitmap of the grid, one integer per column
+    """
+
+    def __init__(self, width, height):
+        super().__init__([0] * width)
+        self.height = height
+
+    def add(self, top, size):
+        mask = ((1 << size[1]) - 1) << top[1]
+        for x in range(top[0], top[0] + size[0]):
+            self[x] |= mask
+
 class MultiRoomEnv(MiniGridEnv):
     """
     Environment with multiple rooms (subgoals)
     """
 
+    state_attrs = MiniGridEnv.state_attrs + ('rooms', 'goal_pos', 'layout_restarts')
+    state_classes = MiniGridEnv.state_classes + (Room,)
+
     def __init__(self,
         minNumRooms,
         maxNumRooms,
@@ -33,37 +113,23 @@ class MultiRoomEnv(MiniGridEnv):
 
         self.rooms = []
 
+        # Number of times the layout generation started over, for the
+        # last level generated
+        self.layout_restarts = 0
+
         super(MultiRoomEnv, self).__init__(
             grid_size=25,
             max_steps=self.maxNumRooms * 20
         )
 
     def _gen_grid(self, width, height):
-        roomList = []
-
         # Choose a random number of rooms to generate
         numRooms = self._rand_int(self.minNumRooms, self.maxNumRooms+1)
 
-        while len(roomList) < numRooms:
-            curRoomList = []
-
-            entryDoorPos = (
-                self._rand_int(0, width - 2),
-                self._rand_int(0, width - 2)
-            )
-
-            # Recursively place the rooms
-            self._placeRoom(
-                numRooms,
-                roomList=curRoomList,
-                minSz=4,
-                maxSz=self.maxRoomSize,
-                entryDoorWall=2,
-                entryDoorPos=entryDoorPos
-            )
-
-            if len(curRoomList) > len(roomList):
-                roomList = curRoomList
+        if self.compat_placement:
+            roomList = self._genRoomsCompat(numRooms, width, height)
+        else:
+            roomList = self._genRooms(numRooms, width, height)
 
         # Store the list of rooms in this environment
         assert len(roomList) > 0
@@ -71,7 +137,6 @@ class MultiRoomEnv(MiniGridEnv):
 
         # Create the grid
         self.grid = Grid(width, height)
-        wall = Wall()
 
         prevDoorColor = None
 
@@ -81,15 +146,9 @@ class MultiRoomEnv(MiniGridEnv):
             topX, topY = room.top
             sizeX, sizeY = room.size
 
-            # Draw the top and bottom walls
-            for i in range(0, sizeX):
-                self.grid.set(topX + i, topY, wall)
-                self.grid.set(topX + i, topY + sizeY - 1, wall)
-
-            # Draw the left and right walls
-            for j in range(0, sizeY):
-                self.grid.set(topX, topY + j, wall)
-                self.grid.set(topX + sizeX - 1, topY + j, wall)
+            # Draw the walls, rooms only share the wall holding the door
+            # between them
+            self.grid.wall_rect(topX, topY, sizeX, sizeY)
 
             # If this isn't the first room, place the entry door
             if idx > 0:
@@ -116,6 +175,150 @@ class MultiRoomEnv(MiniGridEnv):
 
         self.mission = 'traverse the rooms to get to the goal'
 
+    def _genRoomsCompat(self, numRooms, width, height):
+        """
+        Generate the rooms by repeating the randomized recursive search of
+        _placeRoom until it places all of them. The random number generator
+        is used exactly as in earlier versions, so that each seed generates
+        the same level.
+        """
+
+        roomList = []
+        self.layout_restarts = -1
+
+        # The search only draws integers, which are served in bulk
+        with RandIntStream(self):
+            while len(roomList) < numRooms:
+                self.layout_restarts += 1
+                curRoomList = []
+
+                entryDoorPos = (
+                    self._rand_int(0, width - 2),
+                    self._rand_int(0, width - 2)
+                )
+
+                # Recursively place the rooms
+                self._placeRoom(
+                    numRooms,
+                    roomList=curRoomList,
+                    minSz=4,
+                    maxSz=self.maxRoomSize,
+                    entryDoorWall=2,
+                    entryDoorPos=entryDoorPos
+                )
+
+                if len(curRoomList) > len(roomList):
+                    roomList = curRoomList
+
+        return roomList
+
+    def _genRooms(self, numRooms, width, height):
+        """
+        Generate the rooms one after the other, keeping track of the cells
+        covered by the rooms in an occupancy grid. Each room is chosen among
+        the ones fitting behind an exit door of the previous room, and exits
+        where no room fits are discarded. Generation only starts over when
+        no exit of a room leads anywhere.
+        """
+
+        self.layout_restarts = 0
+
+        # Generation only draws integers, which are served in bulk
+        with RandIntStream(self):
+            while True:
+                roomList = self._tryRooms(numRooms, width, height)
+                if roomList is not None:
+                    return roomList
+                self.layout_restarts += 1
+
+    def _tryRooms(self, numRooms, width, height):
+        maxSz = self.maxRoomSize
+
+        # The first room is anywhere in the grid
+        sizeX = self._rand_int(4, maxSz+1)
+        sizeY = self._rand_int(4, maxSz+1)
+        topX = self._rand_int(0, width - sizeX + 1)
+        topY = self._rand_int(0, height - sizeY + 1)
+        roomList = [Room((topX, topY), (sizeX, sizeY), (topX, topY), None)]
+        entryDoorWall = None
+
+        # Cells covered by the rooms before the last one, which the next
+        # room may not overlap, while it can share a wall with the last one
+        occupied = _Occupancy(width, height)
+
+        while len(roomList) < numRooms:
+            nextRoom = self._placeNextRoom(roomList[-1], entryDoorWall, occupied)
+            if nextRoom is None:
+                return None
+
+            room, entryDoorWall = nextRoom
+            occupied.add(roomList[-1].top, roomList[-1].size)
+            roomList.append(room)
+
+        return roomList
+
+    def _placeNextRoom(self, room, entryDoorWall, occupied):
+        """
+        Pick an exit door of a room and a room behind it that does not
+        overlap the occupied cells. Returns the new room and the wall of
+        its entry door, or None if no exit leads anywhere.
+        """
+
+        topX, topY = room.top
+        sizeX, sizeY = room.size
+        templates = _roomTemplates(self.maxRoomSize)
+
+        # All exits, as wall and offset along the wall
+        exits = [
+            (wall, k)
+            for wall in range(0, 4) if wall != entryDoorWall
+            for k in range(1, (sizeY if wall % 2 == 0 else sizeX) - 1)
+        ]
+        numExits = len(exits)
+
+        while numExits > 0:
+            idx = self._rand_int(0, numExits)
+            exitDoorWall, k = exits[idx]
+
+            if exitDoorWall == 0:
+                dx, dy = topX + sizeX - 1, topY + k
+            elif exitDoorWall == 1:
+                dx, dy = topX + k, topY + sizeY - 1
+            elif exitDoorWall == 2:
+                dx, dy = topX, topY + k
+            else:
+                dx, dy = topX + k, topY
+
+            # Exits where none of the smallest rooms fits lead nowhere
+            rooms = templates[exitDoorWall]
+            if any(
+                _fitsIn(occupied, dx + x0, dy + y0, dx + x1, dy + y1)
+                for x0, y0, x1, y1 in rooms[:2]
+            ):
+                # Draw rooms, swapping the ones that don't fit out of the
+                # candidates, until one fits
+                rooms = list(rooms)
+                numCandidates = len(rooms)
+                while True:
+                    r = self._rand_int(0, numCandidates)
+                    x0, y0, x1, y1 = rooms[r]
+                    if _fitsIn(occupied, dx + x0, dy + y0, dx + x1, dy + y1):
+                        nextRoom = Room(
+                            (dx + x0, dy + y0),
+                            (x1 - x0, y1 - y0),
+                            (dx, dy),
+                            None
+                        )
+                        return nextRoom, (exitDoorWall + 2) % 4
+                    numCandidates -= 1
+                    rooms[r] = rooms[numCandidates]
+
+            # Swap the exit out of the candidates
+            numExits -= 1
+            exits[idx] = exits[numExits]
+
+        return None
+
     def _placeRoom(
         self,
         numLeft,
@@ -188,9 +391,7 @@ class MultiRoomEnv(MiniGridEnv):
         for i in range(0, 8):
 
             # Pick which wall to place the out door on
-            wallSet = set((0, 1, 2, 3))
-            wallSet.remove(entryDoorWall)
-            exitDoorWall = self._rand_elem(sorted(wallSet))
+            exitDoorWall = self._rand_elem(EXIT_WALLS[entryDoorWall])
             nextEntryWall = (exitDoorWall + 2) % 4
 
             # Pick the exit door position
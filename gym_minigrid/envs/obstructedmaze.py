@@ -8,6 +8,8 @@ class ObstructedMazeEnv(RoomGrid):
     doors may be obstructed by a ball and keys may be hidden in boxes.
     """
 
+    state_attrs = RoomGrid.state_attrs + ('obj', 'door_colors')
+
     def __init__(self,
         num_rows,
         num_cols,
@@ -8,6 +8,8 @@ class RedBlueDoorEnv(MiniGridEnv):
     obtain a reward.
     """
 
+    state_attrs = MiniGridEnv.state_attrs + ('red_door', 'blue_door')
+
     def __init__(self, size=8):
         self.size = size
 
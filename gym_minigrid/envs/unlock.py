@@ -7,6 +7,8 @@ class Unlock(RoomGrid):
     Unlock a door
     """
 
+    state_attrs = RoomGrid.state_attrs + ('door',)
+
     def __init__(self, seed=4):
         room_size = 8
         super().__init__(
@@ -69,7 +69,9 @@ class Room:
 
 
 
-class Wall(WorldObj):
+class Wall(FlyweightObj):
+    __slots__ = ()
+
     def __init__(self, color='grey'):
         super().__init__('wall', color)
 
@@ -86,7 +88,9 @@ class Wall(WorldObj):
         ])
 
 
-class Goal(WorldObj):
+class Goal(FlyweightObj):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__('goal', 'green')
 
@@ -103,7 +107,9 @@ class Goal(WorldObj):
         ])
 
 
-class Water(WorldObj):
+class Water(FlyweightObj):
+    __slots__ = ()
+
     def __init__(self):
         super(Water, self).__init__('water', 'blue')
 
@@ -121,6 +127,8 @@ class Water(WorldObj):
 
 
 class LightSwitch(WorldObj):
+    __slots__ = ('is_on', 'room', 'position', 'elements')
+
     def __init__(self):
         self.is_on = False
         super(LightSwitch, self).__init__('lightsw', 'yellow')
@@ -185,6 +193,8 @@ class LightSwitch(WorldObj):
 
 
 class Dirt(WorldObj):
+    __slots__ = ('list',)
+
     def __init__(self):
         super(Dirt, self).__init__('dirt', 'yellow')
 
@@ -213,6 +223,8 @@ class Dirt(WorldObj):
 
 
 class Vase(WorldObj):
+    __slots__ = ('content', 'list')
+
     def __init__(self):
         super(Vase, self).__init__('vase', 'grey')
         self.content = Dirt()
@@ -337,6 +349,8 @@ class ExGrid(Grid):
 
 class ExMiniGridEnv(MiniGridEnv):
 
+    state_attrs = MiniGridEnv.state_attrs + ('roomList',)
+    state_classes = MiniGridEnv.state_classes + (Room,)
 
     # Enumeration of possible actions
     class Actions(IntEnum):
@@ -518,8 +532,8 @@ class ExMiniGridEnv(MiniGridEnv):
         elif action == self.actions.toggle:
             if fwd_cell is not None and fwd_cell.type == 'dirt':
                 reward = self.config.rewards.cleaningenv.clean
-            if fwd_cell:
-                fwd_cell.toggle(self, fwd_pos)
+            if fwd_cell and fwd_cell.toggle(self, fwd_pos):
+                self.grid.sync(*fwd_pos, fwd_cell)
 
         # Done action (not used by default)
         elif action == self.actions.done:
@@ -585,8 +599,8 @@ class ExMiniGridEnv(MiniGridEnv):
 
                                 # check if the object position is on the room
                                 if x.objectInRoom((xpos, ypos)):
-                                    if grid.grid[(j * AGENT_VIEW_SIZE) + i] is not None:
-                                        grid.grid[i + (j * AGENT_VIEW_SIZE)] = None
+                                    if grid.get(i, j) is not None:
+                                        grid.set(i, j, None)
 
             for j in range(0, grid.height):
                 for i in range(0, grid.width):
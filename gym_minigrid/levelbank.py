@@ -0,0 +1,502 @@
+import io
+import json
+import pickle
+import numpy as np
+import gym
+from optparse import OptionParser
+
+from .minigrid import MiniGridEnv, Grid, WorldObj, FlyweightObj
+from .minigrid import OBJECT_TO_IDX, STATELESS_CELLS, _reduce_array, find_state_class
+from .register import env_list
+
+# Level bank files start with a fixed-size header holding the magic, the
+# length of a JSON description and the description itself. The records
+# follow, then the JSON list of missions. Records of version 2 also hold
+# the state of the random number generator.
+BANK_MAGIC = b'MGLB'
+BANK_VERSION = 2
+HEADER_SIZE = 4096
+
+# Types of the cells holding objects with per-instance state, which must
+# be created when loading a level
+STATEFUL_TYPES = np.array([row is None for row in STATELESS_CELLS])
+STATEFUL_TYPES[OBJECT_TO_IDX['agent']] = False
+
+# State attributes restored from the fixed record fields, any other state
+# attribute is pickled into the extra field
+RECORD_ATTRS = MiniGridEnv.state_attrs
+
+# Number of levels generated to size the box contents and extra fields,
+# when their sizes aren't given
+SAMPLE_SIZE = 64
+
+def record_dtype(width, height, max_contents, extra_size, version=BANK_VERSION):
+    """
+    Get the dtype of the fixed-size level records
+    """
+
+    fields = [
+        # Encoded grid planes
+        ('planes', 'u1', (width, height, 3)),
+        # Agent pose
+        ('agent_pos', '<i2', (2,)),
+        ('agent_dir', 'u1'),
+        # Index in the table of missions
+        ('mission', '<u4'),
+        # Box contents, by cell index of the box
+        ('num_contents', 'u1'),
+        ('contents_pos', '<u4', (max_contents,)),
+        ('contents', 'u1', (max_contents, 3)),
+        # Pickled environment-specific state attributes
+        ('extra_len', '<u2'),
+        ('extra', 'u1', (extra_size,)),
+    ]
+
+    if version >= 2:
+        fields += [
+            # Random number generator state after generating the level
+            ('rng_keys', '<u4', (624,)),
+            ('rng_pos', '<u2'),
+            ('rng_has_gauss', 'u1'),
+            ('rng_gauss', '<f8'),
+        ]
+
+    return np.dtype(fields)
+
+class _ExtraPickler(pickle.Pickler):
+    """
+    Pickler for the environment-specific state attributes of a level.
+    Objects of the grid and box contents are replaced by their cell index,
+    objects outside of the grid (such as a box that generation replaced
+    by another object) are pickled by value.
+    """
+
+    dispatch_table = {np.ndarray: _reduce_array}
+
+    def __init__(self, file, grid):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.cells = {}
+        for idx, obj in grid.objs.items():
+            self.cells[id(obj)] = ('cell', idx)
+            if obj.contains is not None:
+                self.cells[id(obj.contains)] = ('content', idx)
+
+    def persistent_id(self, obj):
+        if not isinstance(obj, WorldObj):
+            return None
+        if isinstance(obj, FlyweightObj) and type(obj).__dictoffset__ == 0:
+            return None
+        return self.cells.get(id(obj))
+
+class _ExtraUnpickler(pickle.Unpickler):
+    def __init__(self, file, grid, classes):
+        super().__init__(file)
+        self.grid = grid
+        self.classes = classes
+
+    def find_class(self, module, name):
+        return find_state_class(module, name, self.classes)
+
+    def persistent_load(self, pid):
+        kind, idx = pid
+        obj = self.grid.objs[idx]
+        return obj if kind == 'cell' else obj.contains
+
+def _encode_extra(env):
+    """
+    Pickle the state attributes of a level not held by the fixed fields
+    """
+
+    extra = {
+        name: getattr(env, name)
+        for name in env.state_attrs
+        if name not in RECORD_ATTRS and hasattr(env, name)
+    }
+    if not extra:
+        return b''
+
+    buf = io.BytesIO()
+    _ExtraPickler(buf, env.grid).dump(extra)
+    return buf.getvalue()
+
+def _box_contents(grid):
+    """
+    Get the (cell index, contents) pairs of the boxes of a grid
+    """
+
+    return [
+        (idx, obj.contains) for idx, obj in sorted(grid.objs.items())
+        if obj.contains is not None
+    ]
+
+def _write_record(record, env, max_contents, missions):
+    """
+    Fill a level record from a freshly reset environment
+    """
+
+    grid = env.grid
+    record['planes'] = grid.array
+    record['agent_pos'] = env.agent_pos
+    record['agent_dir'] = env.agent_dir
+
+    mission = missions.get(env.mission)
+    if mission is None:
+        mission = missions[env.mission] = len(missions)
+    record['mission'] = mission
+
+    contents = _box_contents(grid)
+    if len(contents) > max_contents:
+        raise ValueError('level has more than %d box contents' % max_contents)
+    record['num_contents'] = len(contents)
+    for k, (idx, obj) in enumerate(contents):
+        if obj.contains is not None:
+            raise ValueError('nested box contents are not supported')
+        record['contents_pos'][k] = idx
+        record['contents'][k] = obj.encode()
+
+    data = _encode_extra(env)
+    if len(data) > len(record['extra']):
+        raise ValueError(
+            'level state takes %d bytes, more than the extra size of %d' %
+            (len(data), len(record['extra']))
+        )
+    record['extra_len'] = len(data)
+    record['extra'][:len(data)] = np.frombuffer(data, dtype='uint8')
+
+    _, keys, pos, has_gauss, cached_gaussian = env.np_random.get_state()
+    record['rng_keys'] = keys
+    record['rng_pos'] = pos
+    record['rng_has_gauss'] = has_gauss
+    record['rng_gauss'] = cached_gaussian
+
+# Environment of each worker process, by id
+_worker_envs = {}
+
+def _build_chunk(args):
+    """
+    Generate the levels of a range of seeds into the bank file, returning
+    the missions of the chunk, whose indices are local to the chunk
+    """
+
+    env_id, path, dtype, seed_start, start, count, max_contents = args
+
+    env = _worker_envs.get(env_id)
+    if env is None:
+        env = _worker_envs[env_id] = gym.make(env_id).unwrapped
+
+    records = np.memmap(
+        path,
+        dtype=dtype,
+        mode='r+',
+        offset=HEADER_SIZE + start * dtype.itemsize,
+        shape=(count,)
+    )
+
+    missions = {}
+    for k in range(0, count):
+        env.seed(seed_start + start + k)
+        env.reset()
+        _write_record(records[k], env, max_contents, missions)
+
+    records.flush()
+    del records
+
+    return start, count, list(missions)
+
+def build_level_bank(
+    env_id,
+    path,
+    seed_start,
+    num_levels,
+    num_workers=None,
+    max_contents=None,
+    extra_size=None,
+    chunk_size=1000,
+    context=None
+):
+    """
+    Generate the levels of an environment for the seeds seed_start to
+    seed_start + num_levels - 1 in worker processes, and write them into a
+    level bank file.
+
+    Any registered environment is supported, RoomGrid ones included, as
+    long as its state_attrs list the attributes set by _gen_grid. Levels
+    may hold up to max_contents boxes with (unnested) contents, and their
+    other state attributes are pickled into extra_size bytes. By default,
+    both are twice the largest values over the first levels.
+    """
+
+    import multiprocessing as mp
+
+    assert env_id in env_list, 'unknown environment %s' % env_id
+    assert num_levels > 0
+
+    env = gym.make(env_id).unwrapped
+    width, height = env.width, env.height
+
+    if max_contents is None or extra_size is None:
+        num_contents = 0
+        extra_len = 0
+        for seed in range(seed_start, seed_start + min(num_levels, SAMPLE_SIZE)):
+            env.seed(seed)
+            env.reset()
+            num_contents = max(num_contents, len(_box_contents(env.grid)))
+            extra_len = max(extra_len, len(_encode_extra(env)))
+        if max_contents is None:
+            max_contents = max(4, 2 * num_contents)
+        if extra_size is None:
+            extra_size = max(64, 2 * extra_len)
+    assert max_contents < 256 and extra_size < 2 ** 16
+
+    env.close()
+
+    dtype = record_dtype(width, height, max_contents, extra_size)
+    missions_offset = HEADER_SIZE + num_levels * dtype.itemsize
+
+    # Size the file before the workers map it
+    with open(path, 'wb') as f:
+        f.truncate(missions_offset)
+
+    chunks = [
+        (env_id, path, dtype, seed_start, start, min(chunk_size, num_levels - start), max_contents)
+        for start in range(0, num_levels, chunk_size)
+    ]
+
+    records = np.memmap(path, dtype=dtype, mode='r+', offset=HEADER_SIZE, shape=(num_levels,))
+    missions = {}
+
+    ctx = mp.get_context(context)
+    with ctx.Pool(num_workers) as pool:
+        for start, count, chunk_missions in pool.imap_unordered(_build_chunk, chunks):
+            # Map the mission indices of the chunk to the global table
+            remap = np.array([
+                missions.setdefault(mission, len(missions))
+                for mission in chunk_missions
+            ], dtype='<u4')
+            ids = records['mission'][start:start+count]
+            records['mission'][start:start+count] = remap[ids]
+
+    records.flush()
+    del records
+
+    info = {
+        'version': BANK_VERSION,
+        'env_id': env_id,
+        'seed_start': seed_start,
+        'num_levels': num_levels,
+        'width': width,
+        'height': height,
+        'max_contents': max_contents,
+        'extra_size': extra_size,
+        'missions_offset': missions_offset
+    }
+    header = json.dumps(info).encode('utf-8')
+    assert len(header) + 8 <= HEADER_SIZE
+
+    with open(path, 'r+b') as f:
+        f.write(BANK_MAGIC)
+        f.write(len(header).to_bytes(4, 'little'))
+        f.write(header)
+        f.seek(missions_offset)
+        f.write(json.dumps(list(missions)).encode('utf-8'))
+
+class LevelBank:
+    """
+    Bank of pre-generated levels for a range of seeds, stored in a file of
+    fixed-size records mapped in memory. Loading a level reads its record
+    in place, without decoding a serialized state. The random number
+    generator is restored to its state after generating the level, so
+    episodes are the same as after seeding and resetting the environment.
+    Banks of version 1 don't hold that state, and leave the generator
+    seeded with the level seed instead.
+
+    Environment-specific state attributes are unpickled from the records,
+    restricted to world objects and the state_classes of the environment,
+    but bank files should still come from a trusted source.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            magic = f.read(4)
+            if magic != BANK_MAGIC:
+                raise ValueError('not a level bank file')
+            size = int.from_bytes(f.read(4), 'little')
+            info = json.loads(f.read(size).decode('utf-8'))
+            if info['version'] > BANK_VERSION:
+                raise ValueError('unsupported level bank version %d' % info['version'])
+            f.seek(info['missions_offset'])
+            self.missions = json.loads(f.read().decode('utf-8'))
+
+        self.env_id = info['env_id']
+        self.seed_start = info['seed_start']
+        self.num_levels = info['num_levels']
+        self.width = info['width']
+        self.height = info['height']
+
+        dtype = record_dtype(
+            self.width,
+            self.height,
+            info['max_contents'],
+            info['extra_size'],
+            info['version']
+        )
+        self.records = np.memmap(
+            path,
+            dtype=dtype,
+            mode='r',
+            offset=HEADER_SIZE,
+            shape=(self.num_levels,)
+        )
+
+    def __len__(self):
+        return self.num_levels
+
+    @property
+    def seeds(self):
+        return range(self.seed_start, self.seed_start + self.num_levels)
+
+    def load(self, env, seed):
+        """
+        Load the level of a seed into an environment
+        """
+
+        env = env.unwrapped
+        assert env.width == self.width and env.height == self.height
+        k = seed - self.seed_start
+        if k < 0 or k >= self.num_levels:
+            raise KeyError('seed %d is not in the bank' % seed)
+        record = self.records[k]
+
+        grid = Grid(self.width, self.height)
+        grid.array[...] = record['planes']
+
+        # Create the objects with per-instance state
+        for i, j in zip(*np.nonzero(STATEFUL_TYPES[grid.array[..., 0]])):
+            i, j = int(i), int(j)
+            obj = WorldObj.decode(*grid.array[i, j].tolist())
+            obj.init_pos = np.array((i, j))
+            obj.cur_pos = np.array((i, j))
+            grid.set(i, j, obj)
+
+        for k in range(0, int(record['num_contents'])):
+            box = grid.objs[int(record['contents_pos'][k])]
+            box.contains = WorldObj.decode(*record['contents'][k].tolist())
+
+        if 'rng_keys' in record.dtype.names:
+            env.np_random.set_state((
+                'MT19937',
+                record['rng_keys'].astype('uint32'),
+                int(record['rng_pos']),
+                int(record['rng_has_gauss']),
+                float(record['rng_gauss'])
+            ))
+        else:
+            env.seed(seed)
+        env.reset_seed = None
+        env.grid = grid
+        x, y = record['agent_pos'].tolist()
+        env.agent_pos = (x, y)
+        env.agent_dir = int(record['agent_dir'])
+        env.carrying = None
+        env.step_count = 0
+        env.mission = self.missions[int(record['mission'])]
+
+        extra_len = int(record['extra_len'])
+        if extra_len > 0:
+            buf = io.BytesIO(record['extra'][:extra_len].tobytes())
+            for name, value in _ExtraUnpickler(buf, grid, env.state_classes).load().items():
+                setattr(env, name, value)
+
+class LevelBankWrapper(gym.core.Wrapper):
+    """
+    Wrapper resetting an environment to levels of a LevelBank instead of
+    generating them. Seeds are drawn uniformly from the bank, or cycled
+    through when a list of seeds is given. The wrapper must be applied
+    directly to the environment, since resets do not go through the
+    wrappers below it.
+    """
+
+    def __init__(self, env, bank, seeds=None, seed=0):
+        super().__init__(env)
+        self.bank = bank if isinstance(bank, LevelBank) else LevelBank(bank)
+        self.seeds = None if seeds is None else list(seeds)
+        self.seed_idx = 0
+        self.bank_rng = np.random.RandomState(seed)
+        self.level_seed = None
+
+    def reset(self, **kwargs):
+        if self.seeds is None:
+            k = self.bank_rng.randint(0, len(self.bank))
+            seed = self.bank.seed_start + k
+        else:
+            seed = self.seeds[self.seed_idx]
+            self.seed_idx = (self.seed_idx + 1) % len(self.seeds)
+
+        self.level_seed = seed
+        env = self.env.unwrapped
+        self.bank.load(env, seed)
+        return env.gen_obs()
+
+    def step(self, action):
+        return self.env.step(action)
+
+def main():
+    parser = OptionParser()
+    parser.add_option(
+        "-e",
+        "--env-name",
+        dest="env_name",
+        help="gym environment to generate levels for",
+        default='MiniGrid-MultiRoom-N6-v0'
+    )
+    parser.add_option(
+        "-o",
+        "--output",
+        dest="output",
+        help="path of the level bank file",
+        default='levels.bank'
+    )
+    parser.add_option(
+        "--seed-start",
+        dest="seed_start",
+        type="int",
+        help="first seed",
+        default=0
+    )
+    parser.add_option(
+        "-n",
+        "--num-levels",
+        dest="num_levels",
+        type="int",
+        help="number of levels (consecutive seeds)",
+        default=10000
+    )
+    parser.add_option(
+        "-w",
+        "--num-workers",
+        dest="num_workers",
+        type="int",
+        help="number of worker processes",
+        default=None
+    )
+    parser.add_option(
+        "--extra-size",
+        dest="extra_size",
+        type="int",
+        help="bytes reserved for environment-specific state, sized from the first levels by default",
+        default=None
+    )
+    (options, args) = parser.parse_args()
+
+    build_level_bank(
+        options.env_name,
+        options.output,
+        options.seed_start,
+        options.num_levels,
+        num_workers=options.num_workers,
+        extra_size=options.extra_size
+    )
+    print('wrote %d levels of %s to %s' % (options.num_levels, options.env_name, options.output))
+
+if __name__ == "__main__":
+    main()
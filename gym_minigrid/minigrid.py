@@ -1,6 +1,18 @@
 import math
+import os
+import sys
+import io
+import struct
+import pickle
+import copyreg
+import asyncio
+import threading
 import gym
 from enum import IntEnum
+from collections import OrderedDict, deque, namedtuple
+from collections.abc import Mapping
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from gym import error, spaces, utils
 from gym.utils import seeding
@@ -61,11 +73,16 @@ DIR_TO_VEC = [
     np.array((0, -1)),
 ]
 
+# Direction vectors as tuples of plain ints, used by MiniGridEnv.step
+DIR_TO_TUPLE = [tuple(int(v) for v in vec) for vec in DIR_TO_VEC]
+
 class WorldObj:
     """
     Base class for grid world objects
     """
 
+    __slots__ = ('type', 'color', 'contains', 'init_pos', 'cur_pos')
+
     def __init__(self, type, color):
         assert type in OBJECT_TO_IDX, type
         assert color in COLOR_TO_IDX, color
@@ -96,9 +113,55 @@ class WorldObj:
         return True
 
     def toggle(self, env, pos):
-        """Method to trigger/toggle an action this object performs"""
+        """
+        Method to trigger/toggle an action this object performs.
+        The grid stores the encoding of each cell, so a change of state
+        must be written back with env.grid.set(*pos, self)
+        """
         return False
 
+    def encode(self):
+        """
+        Encode a description of this object as a 3-tuple of integers.
+        This is what the grid stores, see toggle
+        """
+        return (OBJECT_TO_IDX[self.type], COLOR_TO_IDX[self.color], 0)
+
+    @staticmethod
+    def decode(type_idx, color_idx, state):
+        """Create an object from a 3-tuple state description"""
+
+        obj_type = IDX_TO_OBJECT[type_idx]
+        color = IDX_TO_COLOR[color_idx]
+
+        if obj_type == 'empty' or obj_type == 'unseen':
+            return None
+
+        # State, 0: open, 1: closed, 2: locked
+        is_open = state == 0
+        is_locked = state == 2
+
+        if obj_type == 'wall':
+            v = Wall(color)
+        elif obj_type == 'floor':
+            v = Floor(color)
+        elif obj_type == 'ball':
+            v = Ball(color)
+        elif obj_type == 'key':
+            v = Key(color)
+        elif obj_type == 'box':
+            v = Box(color)
+        elif obj_type == 'door':
+            v = Door(color, is_open, is_locked)
+        elif obj_type == 'goal':
+            v = Goal()
+        elif obj_type == 'lava':
+            v = Lava()
+        else:
+            assert False, "unknown obj type in decode '%s'" % obj_type
+
+        return v
+
     def render(self, r):
         """Draw this object with the given renderer"""
         raise NotImplementedError
@@ -109,7 +172,78 @@ class WorldObj:
         r.setLineColor(c[0], c[1], c[2])
         r.setColor(c[0], c[1], c[2])
 
-class Goal(WorldObj):
+def _shared_obj(cls, type, color):
+    """
+    Get the shared instance of a flyweight class with a given color
+    """
+
+    key = (cls, color)
+    obj = FlyweightMeta.by_color.get(key)
+    if obj is None:
+        obj = object.__new__(cls)
+        WorldObj.__init__(obj, type, color)
+        FlyweightMeta.by_color[key] = obj
+    return obj
+
+class FlyweightMeta(type):
+    """
+    Metaclass of flyweight objects. Calling a flyweight class returns an
+    instance shared with all other calls giving the same arguments, or
+    resulting in the same color. Subclasses that do not define __slots__
+    may hold state, and get a new instance on each call.
+    """
+
+    # Shared instances, by constructor arguments and by color
+    by_args = {}
+    by_color = {}
+
+    def __call__(cls, *args, **kwargs):
+        key = (cls, args, tuple(kwargs.items()))
+        obj = FlyweightMeta.by_args.get(key)
+        if obj is None:
+            obj = super().__call__(*args, **kwargs)
+            if cls.__dictoffset__ != 0:
+                return obj
+            obj = _shared_obj(cls, obj.type, obj.color)
+            FlyweightMeta.by_args[key] = obj
+        return obj
+
+def _flyweight_pos(name):
+    """
+    Position property of flyweight objects. A shared instance may sit in
+    any number of cells, so its position is tracked by the grid (see
+    Grid.positions) and writes are ignored, so that place_obj works with
+    any object. Unshared instances keep their position in their __dict__.
+    """
+
+    def get(self):
+        return getattr(self, '__dict__', {}).get(name)
+
+    def set(self, pos):
+        if hasattr(self, '__dict__'):
+            self.__dict__[name] = pos
+
+    return property(get, set)
+
+class FlyweightObj(WorldObj, metaclass=FlyweightMeta):
+    """
+    Base class for immutable objects, which carry no state beyond their
+    type and color, see FlyweightMeta
+    """
+
+    __slots__ = ()
+
+    def __reduce__(self):
+        if type(self).__dictoffset__ != 0:
+            return super().__reduce__()
+        return (_shared_obj, (type(self), self.type, self.color))
+
+    init_pos = _flyweight_pos('init_pos')
+    cur_pos = _flyweight_pos('cur_pos')
+
+class Goal(FlyweightObj):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__('goal', 'green')
 
@@ -125,11 +259,13 @@ class Goal(WorldObj):
             (0          ,           0)
         ])
 
-class Floor(WorldObj):
+class Floor(FlyweightObj):
     """
     Colored floor tile the agent can walk over
     """
 
+    __slots__ = ()
+
     def __init__(self, color='blue'):
         super().__init__('floor', color)
 
@@ -148,7 +284,9 @@ class Floor(WorldObj):
             (1          ,           1)
         ])
 
-class Lava(WorldObj):
+class Lava(FlyweightObj):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__('lava', 'red')
 
@@ -193,7 +331,9 @@ class Lava(WorldObj):
             (.9 * CELL_PIXELS, .7 * CELL_PIXELS),
         ])
 
-class Wall(WorldObj):
+class Wall(FlyweightObj):
+    __slots__ = ()
+
     def __init__(self, color='grey'):
         super().__init__('wall', color)
 
@@ -210,6 +350,8 @@ class Wall(WorldObj):
         ])
 
 class Door(WorldObj):
+    __slots__ = ('is_open', 'is_locked')
+
     def __init__(self, color, is_open=False, is_locked=False):
         super().__init__('door', color)
         self.is_open = is_open
@@ -228,12 +370,28 @@ class Door(WorldObj):
             if isinstance(env.carrying, Key) and env.carrying.color == self.color:
                 self.is_locked = False
                 self.is_open = True
+                # Write the new state back into the grid planes
+                env.grid.set(*pos, self)
                 return True
             return False
 
         self.is_open = not self.is_open
+        env.grid.set(*pos, self)
         return True
 
+    def encode(self):
+        """Encode a description of this object as a 3-tuple of integers"""
+
+        # State, 0: open, 1: closed, 2: locked
+        if self.is_locked:
+            state = 2
+        elif not self.is_open:
+            state = 1
+        else:
+            state = 0
+
+        return (OBJECT_TO_IDX[self.type], COLOR_TO_IDX[self.color], state)
+
     def render(self, r):
         c = COLORS[self.color]
         r.setLineColor(c[0], c[1], c[2])
@@ -274,6 +432,8 @@ class Door(WorldObj):
             r.drawCircle(CELL_PIXELS * 0.75, CELL_PIXELS * 0.5, 2)
 
 class Key(WorldObj):
+    __slots__ = ()
+
     def __init__(self, color='blue'):
         super(Key, self).__init__('key', color)
 
@@ -311,6 +471,8 @@ class Key(WorldObj):
         r.drawCircle(18, 9, 2)
 
 class Ball(WorldObj):
+    __slots__ = ()
+
     def __init__(self, color='blue'):
         super(Ball, self).__init__('ball', color)
 
@@ -322,6 +484,8 @@ class Ball(WorldObj):
         r.drawCircle(CELL_PIXELS * 0.5, CELL_PIXELS * 0.5, 10)
 
 class Box(WorldObj):
+    __slots__ = ()
+
     def __init__(self, color, contains=None):
         super(Box, self).__init__('box', color)
         self.contains = contains
@@ -356,11 +520,82 @@ class Box(WorldObj):
         env.grid.set(*pos, self.contains)
         return True
 
+# Object types that carry no state beyond their type and color. Cells holding
+# one of these are fully described by the grid planes, any other object is
+# also kept in the grid side-table so that its identity is preserved
+STATELESS_OBJS = (Wall, Floor, Goal, Lava)
+
+# Shared instances of the stateless objects used by Grid.get, indexed by
+# type and then color index. Empty and unseen cells map to None, and types
+# that are not stateless have no row.
+STATELESS_CELLS = [None] * len(OBJECT_TO_IDX)
+for type_idx in (OBJECT_TO_IDX['unseen'], OBJECT_TO_IDX['empty']):
+    STATELESS_CELLS[type_idx] = [None] * len(COLOR_TO_IDX)
+for obj_type in ('wall', 'floor', 'goal', 'lava'):
+    type_idx = OBJECT_TO_IDX[obj_type]
+    STATELESS_CELLS[type_idx] = [
+        WorldObj.decode(type_idx, color_idx, 0)
+        for color_idx in range(0, len(COLOR_TO_IDX))
+    ]
+
+# Encodings of an empty cell and of the walls surrounding the grid
+EMPTY_CELL = (OBJECT_TO_IDX['empty'], 0, 0)
+WALL_CELL = (OBJECT_TO_IDX['wall'], COLOR_TO_IDX['grey'], 0)
+
+# Types of the cells objects can be placed on, indexed by type
+FREE_TYPES = np.zeros(256, dtype=bool)
+FREE_TYPES[[OBJECT_TO_IDX['unseen'], OBJECT_TO_IDX['empty']]] = True
+
+# Lookup tables used by Grid.decode, indexed by encoded value
+DECODE_KEEP = 255
+# Types that may appear in an encoding
+DECODE_VALID = np.zeros(256, dtype=bool)
+DECODE_VALID[[
+    OBJECT_TO_IDX[t] for t in OBJECT_TO_IDX if t != 'agent'
+]] = True
+# Decoded type, unseen cells are decoded as empty
+DECODE_TYPE = np.arange(256, dtype='uint8')
+DECODE_TYPE[OBJECT_TO_IDX['unseen']] = OBJECT_TO_IDX['empty']
+# Decoded color, objects with a fixed color ignore the encoded one
+DECODE_COLOR = np.full(256, DECODE_KEEP, dtype='uint8')
+DECODE_COLOR[OBJECT_TO_IDX['unseen']] = 0
+DECODE_COLOR[OBJECT_TO_IDX['empty']] = 0
+DECODE_COLOR[OBJECT_TO_IDX['goal']] = COLOR_TO_IDX['green']
+DECODE_COLOR[OBJECT_TO_IDX['lava']] = COLOR_TO_IDX['red']
+# Decoded door state, 0: open, 1: closed, 2: locked
+DECODE_DOOR_STATE = np.ones(256, dtype='uint8')
+DECODE_DOOR_STATE[0] = 0
+DECODE_DOOR_STATE[2] = 2
+
+MASK64 = (1 << 64) - 1
+
+def zobrist_key(idx, type_idx, color_idx, state):
+    """
+    Pseudo-random 64-bit key of an encoded object at flat cell index idx,
+    used to hash grids by XORing the keys of their non-empty cells.
+    Works on Python integers as well as on numpy uint64 arrays.
+    """
+
+    # SplitMix64 finalizer applied to the packed cell encoding
+    x = ((idx << 24 | type_idx << 16 | color_idx << 8 | state) + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
 class Grid:
     """
     Represent a grid and operations on it
+
+    The contents of the grid are stored in a (width, height, 3) uint8 array
+    holding the type, color and state planes, using the same layout as the
+    `encode` method. Objects with per-instance behaviour are also kept in
+    a side-table indexed by cell, so that `get` returns the very object that
+    was `set`. Stateless tiles are stored by value only.
     """
 
+    # Number of changes remembered by the journal of each grid
+    journal_size = 1024
+
     def __init__(self, width, height):
         assert width >= 3
         assert height >= 3
@@ -368,27 +603,60 @@ class Grid:
         self.width = width
         self.height = height
 
-        self.grid = [None] * width * height
+        # Version counter, bumped by every change to the grid, and journal
+        # of the cells changed by the most recent versions
+        self.version = 0
+        self.journal = deque(maxlen=self.journal_size)
+
+        # Type, color and state planes
+        self.array = np.zeros((width, height, 3), dtype='uint8')
+        self.array[:, :] = EMPTY_CELL
+
+        # Objects with per-instance behaviour, indexed by j * width + i
+        self.objs = {}
+
+        # Index of the non-empty cells, see _index
+        self._cells = None
+
+        # Zobrist hash of the grid contents, see hash
+        self._hash = None
+
+        # Buffer holding the planes surrounded by a border of walls
+        self._padded = None
+        self._pad = 0
+
+    @property
+    def grid(self):
+        """
+        List of the grid contents, in row-major order
+        """
+
+        return [
+            self.get(i, j)
+            for j in range(self.height)
+            for i in range(self.width)
+        ]
 
     def __contains__(self, key):
         if isinstance(key, WorldObj):
-            for e in self.grid:
-                if e is key:
-                    return True
-        elif isinstance(key, tuple):
-            for e in self.grid:
-                if e is None:
-                    continue
-                if (e.color, e.type) == key:
-                    return True
-                if key[0] is None and key[1] == e.type:
-                    return True
+            if type(key) not in STATELESS_OBJS:
+                for e in self.objs.values():
+                    if e is key:
+                        return True
+                return False
+            # Stateless tiles are stored by value
+            key = (key.color, key.type)
+        if isinstance(key, tuple):
+            color, obj_type = key
+            return self.count(obj_type, color) > 0
         return False
 
     def __eq__(self, other):
-        grid1 = self.encode()
-        grid2 = other.encode()
-        return np.array_equal(grid2, grid1)
+        if self.width != other.width or self.height != other.height:
+            return False
+        if self.hash() != other.hash():
+            return False
+        return np.array_equal(self.array, other.array)
 
     def __ne__(self, other):
         return not self == other
@@ -400,24 +668,204 @@ class Grid:
     def set(self, i, j, v):
         assert i >= 0 and i < self.width
         assert j >= 0 and j < self.height
-        self.grid[j * self.width + i] = v
+
+        idx = int(j) * self.width + int(i)
+
+        self.version += 1
+        self.journal.append(idx)
+
+        cells = self._cells
+        if cells is not None or self._hash is not None:
+            type_idx, color_idx, state = self.array[i, j].tolist()
+            if type_idx != OBJECT_TO_IDX['empty']:
+                if cells is not None:
+                    cells[type_idx].discard(idx)
+                    cells[type_idx, color_idx].discard(idx)
+                if self._hash is not None:
+                    self._hash ^= zobrist_key(idx, type_idx, color_idx, state)
+
+        if v is None:
+            self.array[i, j] = EMPTY_CELL
+            self.objs.pop(idx, None)
+            return
+
+        type_idx, color_idx, state = v.encode()
+        self.array[i, j] = (type_idx, color_idx, state)
+        if type(v) in STATELESS_OBJS:
+            self.objs.pop(idx, None)
+        else:
+            self.objs[idx] = v
+
+        if cells is not None:
+            cells.setdefault(type_idx, set()).add(idx)
+            cells.setdefault((type_idx, color_idx), set()).add(idx)
+        if self._hash is not None:
+            self._hash ^= zobrist_key(idx, type_idx, color_idx, state)
+
+    def changes_since(self, version):
+        """
+        Get the set of (i, j) cells changed since the given version of the
+        grid, or None if the journal doesn't go back that far, in which case
+        the whole grid must be considered as changed
+        """
+
+        num_changes = self.version - version
+        assert num_changes >= 0
+
+        if num_changes > len(self.journal):
+            return None
+
+        return set(
+            (idx % self.width, idx // self.width)
+            for idx in islice(reversed(self.journal), num_changes)
+        )
+
+    def touch_all(self):
+        """
+        Record a change that may affect any cell of the grid, for instance
+        after writing directly to the grid planes
+        """
+
+        self.version += 1
+        self.journal.clear()
+        self._cells = None
+        self._hash = None
+
+    def hash(self):
+        """
+        Get a 64-bit Zobrist hash of the grid contents. The hash is computed
+        from the planes when first needed, and then updated by set in
+        constant time. Object state changes, such as doors opening, are
+        written back with set and so are accounted for.
+        """
+
+        if self._hash is None:
+            xs, ys = np.nonzero(self.array[:, :, 0] != OBJECT_TO_IDX['empty'])
+            cells = self.array[xs, ys].astype('uint64')
+            keys = zobrist_key(
+                (ys * self.width + xs).astype('uint64'),
+                cells[:, 0],
+                cells[:, 1],
+                cells[:, 2]
+            )
+            self._hash = int(np.bitwise_xor.reduce(keys, initial=0))
+
+        return self._hash
+
+    def _index(self):
+        """
+        Get the index of the non-empty cells of the grid, mapping type
+        indices and (type, color) index pairs to the set of cells holding
+        such objects. The index is built from the planes when first needed,
+        and then kept up to date by set.
+        """
+
+        if self._cells is None:
+            cells = {}
+            xs, ys = np.nonzero(self.array[:, :, 0] != OBJECT_TO_IDX['empty'])
+            keys = self.array[xs, ys, :2].tolist()
+            for i, j, (type_idx, color_idx) in zip(xs.tolist(), ys.tolist(), keys):
+                idx = j * self.width + i
+                cells.setdefault(type_idx, set()).add(idx)
+                cells.setdefault((type_idx, color_idx), set()).add(idx)
+            self._cells = cells
+
+        return self._cells
+
+    def _indexed_cells(self, type, color=None):
+        if type not in OBJECT_TO_IDX or type == 'empty':
+            return ()
+        if color is not None and color not in COLOR_TO_IDX:
+            return ()
+        if color is None:
+            key = OBJECT_TO_IDX[type]
+        else:
+            key = (OBJECT_TO_IDX[type], COLOR_TO_IDX[color])
+        return self._index().get(key, ())
+
+    def count(self, type, color=None):
+        """
+        Count the objects of a given type, and optionally of a given color
+        """
+
+        return len(self._indexed_cells(type, color))
+
+    def positions(self, type, color=None):
+        """
+        List the (i, j) positions of the objects of a given type, and
+        optionally of a given color, in row-major order
+        """
+
+        return [
+            (idx % self.width, idx // self.width)
+            for idx in sorted(self._indexed_cells(type, color))
+        ]
+
+    def sync(self, i, j, v):
+        """
+        Write the state of object v back into the planes, if it is still in
+        cell (i, j) and its encoding no longer matches them. This catches
+        objects changing state without going through set
+        """
+
+        if self.objs.get(int(j) * self.width + int(i)) is not v:
+            return
+        if tuple(self.array[i, j].tolist()) != tuple(v.encode()):
+            self.set(i, j, v)
 
     def get(self, i, j):
         assert i >= 0 and i < self.width
         assert j >= 0 and j < self.height
-        return self.grid[j * self.width + i]
+
+        v = self.objs.get(j * self.width + i)
+        if v is not None:
+            return v
+
+        # Stateless tiles are shared instances, looked up from the planes
+        array = self.array
+        type_idx = array.item(i, j, 0)
+        row = STATELESS_CELLS[type_idx]
+        if row is not None:
+            return row[array.item(i, j, 1)]
+        return WorldObj.decode(type_idx, array.item(i, j, 1), array.item(i, j, 2))
+
+    def fill_rect(self, x, y, w, h, v):
+        """
+        Fill a rectangle of cells with a stateless object, such as a wall,
+        writing the grid planes directly
+        """
+
+        if w <= 0 or h <= 0:
+            return
+        assert x >= 0 and x + w <= self.width
+        assert y >= 0 and y + h <= self.height
+        assert type(v) in STATELESS_OBJS
+
+        cells = [
+            j * self.width + i
+            for j in range(y, y + h)
+            for i in range(x, x + w)
+        ]
+        self.version += len(cells)
+        self.journal.extend(cells)
+
+        self.array[x:x+w, y:y+h] = v.encode()
+        if self.objs:
+            for idx in cells:
+                self.objs.pop(idx, None)
+
+        self._cells = None
+        self._hash = None
 
     def horz_wall(self, x, y, length=None):
         if length is None:
             length = self.width - x
-        for i in range(0, length):
-            self.set(x + i, y, Wall())
+        self.fill_rect(x, y, length, 1, Wall())
 
     def vert_wall(self, x, y, length=None):
         if length is None:
             length = self.height - y
-        for j in range(0, length):
-            self.set(x, y + j, Wall())
+        self.fill_rect(x, y, 1, length, Wall())
 
     def wall_rect(self, x, y, w, h):
         self.horz_wall(x, y, w)
@@ -432,10 +880,12 @@ class Grid:
 
         grid = Grid(self.height, self.width)
 
-        for i in range(self.width):
-            for j in range(self.height):
-                v = self.get(i, j)
-                grid.set(j, grid.height - 1 - i, v)
+        # Cell (i, j) moves to (j, width - 1 - i)
+        grid.array = np.rot90(self.array, k=-1).copy()
+
+        for idx, v in self.objs.items():
+            i, j = idx % self.width, idx // self.width
+            grid.objs[(grid.height - 1 - i) * grid.width + j] = v
 
         return grid
 
@@ -446,18 +896,23 @@ class Grid:
 
         grid = Grid(width, height)
 
-        for j in range(0, height):
-            for i in range(0, width):
-                x = topX + i
-                y = topY + j
+        # Cells outside of the grid are seen as walls
+        grid.array[:, :] = WALL_CELL
+
+        # Extents of the part of the slice that overlaps with the grid
+        x0, y0 = max(topX, 0), max(topY, 0)
+        x1 = min(topX + width, self.width)
+        y1 = min(topY + height, self.height)
 
-                if x >= 0 and x < self.width and \
-                   y >= 0 and y < self.height:
-                    v = self.get(x, y)
-                else:
-                    v = Wall()
+        if x0 >= x1 or y0 >= y1:
+            return grid
 
-                grid.set(i, j, v)
+        grid.array[x0-topX:x1-topX, y0-topY:y1-topY] = self.array[x0:x1, y0:y1]
+
+        for idx, v in self.objs.items():
+            x, y = idx % self.width, idx // self.width
+            if x0 <= x < x1 and y0 <= y < y1:
+                grid.objs[(y - topY) * width + (x - topX)] = v
 
         return grid
 
@@ -517,119 +972,678 @@ class Grid:
         Produce a compact numpy encoding of the grid
         """
 
-        if vis_mask is None:
-            vis_mask = np.ones((self.width, self.height), dtype=bool)
+        array = self.array.copy()
 
-        array = np.zeros((self.width, self.height, 3), dtype='uint8')
-        for i in range(self.width):
-            for j in range(self.height):
-                if vis_mask[i, j]:
-                    v = self.get(i, j)
-
-                    if v is None:
-                        array[i, j, 0] = OBJECT_TO_IDX['empty']
-                        array[i, j, 1] = 0
-                        array[i, j, 2] = 0
-                    else:
-                        # State, 0: open, 1: closed, 2: locked
-                        state = 0
-                        if hasattr(v, 'is_open') and not v.is_open:
-                            state = 1
-                        if hasattr(v, 'is_locked') and v.is_locked:
-                            state = 2
-
-                        array[i, j, 0] = OBJECT_TO_IDX[v.type]
-                        array[i, j, 1] = COLOR_TO_IDX[v.color]
-                        array[i, j, 2] = state
+        # Cells that are not visible are encoded as unseen (all zeros)
+        if vis_mask is not None:
+            array[np.logical_not(vis_mask)] = 0
 
         return array
 
     @staticmethod
     def decode(array):
         """
-        Decode an array grid encoding back into a grid
+        Decode an array grid encoding back into a grid.
+        A stack of encodings of shape (N, width, height, 3) is decoded
+        into a list of N grids.
         """
 
-        width, height, channels = array.shape
+        array = np.asarray(array, dtype='uint8')
+        assert array.ndim in (3, 4)
+        width, height, channels = array.shape[-3:]
         assert channels == 3
 
-        grid = Grid(width, height)
-        for i in range(width):
-            for j in range(height):
-                typeIdx, colorIdx, state = array[i, j]
+        types = array[..., 0]
+        assert DECODE_VALID[types].all(), "unknown obj type in decode"
+
+        # Unseen cells are decoded as empty cells, and the color and
+        # state planes are normalized through the lookup tables so that
+        # re-encoding the grid matches what the decoded objects encode to
+        colors = DECODE_COLOR[types]
+        colors = np.where(colors == DECODE_KEEP, array[..., 1], colors)
+        assert (colors < len(COLOR_TO_IDX)).all(), "unknown color in decode"
+
+        planes = np.empty(array.shape, dtype='uint8')
+        planes[..., 0] = DECODE_TYPE[types]
+        planes[..., 1] = colors
+        planes[..., 2] = np.where(
+            types == OBJECT_TO_IDX['door'],
+            DECODE_DOOR_STATE[array[..., 2]],
+            0
+        )
 
-                if typeIdx == OBJECT_TO_IDX['unseen'] or \
-                        typeIdx == OBJECT_TO_IDX['empty']:
-                    continue
+        if array.ndim == 3:
+            grid = Grid(width, height)
+            grid.array = planes
+            return grid
 
-                objType = IDX_TO_OBJECT[typeIdx]
-                color = IDX_TO_COLOR[colorIdx]
-                # State, 0: open, 1: closed, 2: locked
-                is_open = state == 0
-                is_locked = state == 2
-
-                if objType == 'wall':
-                    v = Wall(color)
-                elif objType == 'floor':
-                    v = Floor(color)
-                elif objType == 'ball':
-                    v = Ball(color)
-                elif objType == 'key':
-                    v = Key(color)
-                elif objType == 'box':
-                    v = Box(color)
-                elif objType == 'door':
-                    v = Door(color, is_open, is_locked)
-                elif objType == 'goal':
-                    v = Goal()
-                elif objType == 'lava':
-                    v = Lava()
-                else:
-                    assert False, "unknown obj type in decode '%s'" % objType
-
-                grid.set(i, j, v)
+        grids = []
+        for grid_planes in planes:
+            grid = Grid(width, height)
+            grid.array = grid_planes
+            grids.append(grid)
 
-        return grid
+        return grids
 
-    def process_vis(grid, agent_pos):
-        mask = np.zeros(shape=(grid.width, grid.height), dtype=np.bool)
+    def padded(self, pad):
+        """
+        Get the grid planes surrounded by a border of walls at least pad
+        cells wide, along with the actual width of the border.
+        The grid array lives inside of the padded buffer, so that slices
+        of the buffer are views that always reflect the grid contents.
+        """
 
-        mask[agent_pos[0], agent_pos[1]] = True
+        buf = self._padded
+        if buf is None or self.array.base is not buf or self._pad < pad:
+            buf = np.empty(
+                (self.width + 2 * pad, self.height + 2 * pad, 3),
+                dtype='uint8'
+            )
+            buf[:, :] = WALL_CELL
+            buf[pad:pad+self.width, pad:pad+self.height] = self.array
+            self.array = buf[pad:pad+self.width, pad:pad+self.height]
+            self._padded = buf
+            self._pad = pad
 
-        for j in reversed(range(0, grid.height)):
-            for i in range(0, grid.width-1):
-                if not mask[i, j]:
-                    continue
+        return buf, self._pad
 
-                cell = grid.get(i, j)
-                if cell and not cell.see_behind():
-                    continue
+    def custom_occluders(self):
+        """
+        Iterate over the side-table objects whose see_behind method isn't
+        described by the grid planes, as (i, j, see_behind) tuples
+        """
 
-                mask[i+1, j] = True
-                if j > 0:
-                    mask[i+1, j-1] = True
-                    mask[i, j-1] = True
+        for idx, v in self.objs.items():
+            if type(v).see_behind not in PLANE_SEE_BEHIND:
+                yield idx % self.width, idx // self.width, v.see_behind()
 
-            for i in reversed(range(1, grid.width)):
-                if not mask[i, j]:
-                    continue
+    def see_behind_mask(self):
+        """
+        Boolean (width, height) array telling which cells the agent can
+        see behind
+        """
 
-                cell = grid.get(i, j)
-                if cell and not cell.see_behind():
-                    continue
+        mask = see_behind_planes(self.array)
+        for i, j, see_behind in self.custom_occluders():
+            mask[i, j] = see_behind
 
-                mask[i-1, j] = True
-                if j > 0:
-                    mask[i-1, j-1] = True
-                    mask[i, j-1] = True
+        return mask
+
+    def process_vis(grid, agent_pos, cache=None):
+        mask = vis_mask_from_occluders(grid.see_behind_mask(), agent_pos, cache)
 
-        for j in range(0, grid.height):
-            for i in range(0, grid.width):
-                if not mask[i, j]:
-                    grid.set(i, j, None)
+        # Clear the cells the agent can't see
+        grid.array[np.logical_not(mask)] = EMPTY_CELL
+        for idx in list(grid.objs):
+            if not mask[idx % grid.width, idx // grid.width]:
+                del grid.objs[idx]
+        grid.touch_all()
 
         return mask
 
+# Implementations of see_behind that the type and state planes account for
+PLANE_SEE_BEHIND = (WorldObj.see_behind, Wall.see_behind, Door.see_behind)
+
+def see_behind_planes(array):
+    """
+    Tell which cells of an array of grid planes the agent can see behind,
+    going by the type and state of the objects in it
+    """
+
+    types = array[..., 0]
+    mask = types != OBJECT_TO_IDX['wall']
+    mask &= (types != OBJECT_TO_IDX['door']) | (array[..., 2] == 0)
+    return mask
+
+def _fill_right(gen, pro, width):
+    """
+    Occluded fill of the bits in gen towards higher bits, through the
+    bits set in pro (Kogge-Stone, log2(width) steps)
+    """
+
+    shift = 1
+    while shift < width:
+        gen |= pro & (gen << shift)
+        pro &= pro << shift
+        shift *= 2
+    return gen
+
+def _fill_left(gen, pro, width):
+    """
+    Occluded fill of the bits in gen towards lower bits, through the
+    bits set in pro
+    """
+
+    shift = 1
+    while shift < width:
+        gen |= pro & (gen >> shift)
+        pro &= pro >> shift
+        shift *= 2
+    return gen
+
+def vis_mask_rows(see_behind_rows, width, agent_pos):
+    """
+    Propagate visibility from the agent position over a grid described by
+    one bitmask per row (bit i set if the agent can see behind cell i).
+    Returns one visibility bitmask per row.
+
+    Each row is swept in a constant number of integer operations, with
+    the same semantics as the original cell-by-cell propagation: light
+    spreads left to right, then right to left, through cells the agent
+    can see behind, and every such visible cell also lights its upper
+    neighbors.
+    """
+
+    height = len(see_behind_rows)
+    full = (1 << width) - 1
+    # Cells that have a right neighbor (left-to-right pass) and cells
+    # that have a left neighbor (right-to-left pass)
+    has_right = full >> 1
+    has_left = full & ~1
+
+    ax, ay = int(agent_pos[0]), int(agent_pos[1])
+    mask_rows = [0] * height
+    mask_rows[ay] = 1 << ax
+
+    for j in reversed(range(0, ay + 1)):
+        seen = mask_rows[j]
+        if not seen:
+            break
+        pro = see_behind_rows[j]
+
+        # Left to right pass
+        seen |= (_fill_right(seen & pro, pro, width) << 1) & full
+        src = seen & pro & has_right
+        up = src | (src << 1)
+
+        # Right to left pass
+        seen |= _fill_left(seen & pro, pro, width) >> 1
+        src = seen & pro & has_left
+        up |= src | (src >> 1)
+
+        mask_rows[j] = seen
+        if j > 0:
+            mask_rows[j-1] |= up
+
+    return mask_rows
+
+class VisMaskCache:
+    """
+    Bounded LRU cache of visibility masks, keyed by the packed see-behind
+    pattern of a grid and the agent position. For a fixed view size, the
+    visibility mask only depends on these, and levels tend to repeat the
+    same local wall configurations.
+    Note that the masks returned from the cache are read-only arrays.
+    The cache can be shared by environments stepped from several threads.
+    """
+
+    def __init__(self, max_size=4096):
+        assert max_size > 0
+        self.max_size = max_size
+        self.masks = OrderedDict()
+        self.lock = threading.Lock()
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.masks)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0
+
+    def get(self, key):
+        with self.lock:
+            mask = self.masks.get(key)
+
+            if mask is None:
+                self.misses += 1
+                return None
+
+            self.masks.move_to_end(key)
+            self.hits += 1
+            return mask
+
+    def put(self, key, mask):
+        mask.flags.writeable = False
+
+        with self.lock:
+            self.masks[key] = mask
+
+            # Evict the least recently used mask
+            if len(self.masks) > self.max_size:
+                self.masks.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.masks.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+class LevelCache:
+    """
+    Bounded LRU cache of generated levels, keyed by environment class,
+    constructor arguments and seed. Levels are stored as get_state blobs
+    taken right after generation, so that resetting an environment with a
+    seed it was already reset with is a state restore instead of a call to
+    _gen_grid. Environments whose configuration is changed after
+    construction should not share a cache with others. The cache can be
+    shared by environments stepped from several threads.
+    """
+
+    def __init__(self, max_size=256):
+        assert max_size > 0
+        self.max_size = max_size
+        self.levels = OrderedDict()
+        self.lock = threading.Lock()
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.levels)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0
+
+    def get(self, key):
+        with self.lock:
+            blob = self.levels.get(key)
+
+            if blob is None:
+                self.misses += 1
+                return None
+
+            self.levels.move_to_end(key)
+            self.hits += 1
+            return blob
+
+    def put(self, key, blob):
+        with self.lock:
+            self.levels[key] = blob
+            self.levels.move_to_end(key)
+
+            # Evict the least recently used level
+            if len(self.levels) > self.max_size:
+                self.levels.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.levels.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+class RandIntStream:
+    """
+    Serves the _rand_int calls of an environment within a with block from
+    32-bit words generated in bulk, drawing the same integers as
+    RandomState.randint would. On exit, the random number generator is
+    left in the state it would be in after these calls. Only _rand_int
+    and the helpers built on it, such as _rand_elem, may be used in the
+    block, any other use of the generator is lost.
+    """
+
+    def __init__(self, env, chunk_size=256):
+        self.env = env
+        self.rng = env.np_random
+        self.chunk_size = chunk_size
+
+        self.words = []
+        self.pos = 0
+        self.consumed = 0
+        self.state = None
+
+    def randint(self, low, high):
+        """
+        Generate random integer in [low,high[
+        """
+
+        # Same bounded generation as RandomState.randint, which masks
+        # words to the smallest power of two above the range and rejects
+        # the values out of range. Ranges of one value use no word.
+        span = high - low - 1
+        if span < 0:
+            raise ValueError('low >= high')
+        if span == 0:
+            return low
+        assert span < 0xFFFFFFFF
+        mask = (1 << span.bit_length()) - 1
+
+        words = self.words
+        pos = self.pos
+        while True:
+            if pos == len(words):
+                self.consumed += pos
+                if self.state is None:
+                    self.state = self.rng.get_state()
+                words = self.words = self.rng.randint(
+                    0, 1 << 32, size=self.chunk_size, dtype='uint64'
+                ).tolist()
+                pos = 0
+            v = words[pos] & mask
+            pos += 1
+            if v <= span:
+                self.pos = pos
+                return low + v
+
+    def __enter__(self):
+        self.env._rand_int = self.randint
+        return self
+
+    def __exit__(self, *args):
+        del self.env._rand_int
+
+        # Rewind the generator, then skip the words that were used
+        if self.state is not None:
+            self.rng.set_state(self.state)
+            consumed = self.consumed + self.pos
+            self.rng.randint(0, 1 << 32, size=consumed, dtype='uint64')
+
+def vis_mask_from_occluders(see_behind, agent_pos, cache=None):
+    """
+    Compute the visibility mask of a (width, height) boolean array telling
+    which cells the agent can see behind, optionally memoized in a
+    VisMaskCache
+    """
+
+    width, height = see_behind.shape
+    nbytes = (width + 7) // 8
+
+    # Pack each row of the grid into an integer bitmask
+    packed = np.packbits(see_behind, axis=0, bitorder='little').T.tobytes()
+
+    if cache is not None:
+        key = (width, height, int(agent_pos[0]), int(agent_pos[1]), packed)
+        mask = cache.get(key)
+        if mask is not None:
+            return mask
+
+    rows = [
+        int.from_bytes(packed[j*nbytes:(j+1)*nbytes], 'little')
+        for j in range(height)
+    ]
+
+    mask_rows = vis_mask_rows(rows, width, agent_pos)
+
+    packed = b''.join(r.to_bytes(nbytes, 'little') for r in mask_rows)
+    packed = np.frombuffer(packed, dtype='uint8').reshape(height, nbytes)
+    mask = np.unpackbits(packed, axis=1, count=width, bitorder='little')
+    mask = mask.T.astype(bool)
+
+    if cache is not None:
+        cache.put(key, mask)
+
+    return mask
+
+# Snapshot of the state of an environment, see MiniGridEnv.clone_state
+EnvState = namedtuple('EnvState', [
+    'grid',
+    'planes',
+    'objs',
+    'grid_hash',
+    'obj_states',
+    'attrs',
+    'rng_state'
+])
+
+def _copy_value(v):
+    """
+    Copy the mutable containers used as environment attributes
+    """
+
+    if isinstance(v, np.ndarray):
+        return v.copy()
+    if isinstance(v, list):
+        return list(v)
+    return v
+
+def _collect_objs(v, objs):
+    """
+    Collect the objects reachable from an environment attribute, whose
+    own attributes are part of the environment state
+    """
+
+    if isinstance(v, (list, tuple)):
+        for e in v:
+            _collect_objs(e, objs)
+    elif isinstance(v, WorldObj) or hasattr(v, '__dict__'):
+        if id(v) not in objs:
+            objs[id(v)] = v
+            _collect_objs(getattr(v, 'contains', None), objs)
+
+# Slot names of each class, see _slot_names
+_SLOT_NAMES = {}
+
+def _slot_names(cls):
+    """
+    List the names of the slots defined by a class and its bases
+    """
+
+    names = _SLOT_NAMES.get(cls)
+    if names is None:
+        names = []
+        for c in cls.__mro__:
+            slots = c.__dict__.get('__slots__', ())
+            if isinstance(slots, str):
+                slots = (slots,)
+            names.extend(n for n in slots if n not in ('__dict__', '__weakref__'))
+        names = _SLOT_NAMES[cls] = tuple(names)
+    return names
+
+def _get_obj_state(obj):
+    """
+    Get the values of the attributes of an object, in slots or in __dict__
+    """
+
+    state = {}
+    for name in _slot_names(type(obj)):
+        if hasattr(obj, name):
+            state[name] = getattr(obj, name)
+    if hasattr(obj, '__dict__'):
+        state.update(vars(obj))
+    return state
+
+def _set_obj_state(obj, state):
+    """
+    Restore the attribute values obtained with _get_obj_state
+    """
+
+    if hasattr(obj, '__dict__'):
+        vars(obj).clear()
+    for name in _slot_names(type(obj)):
+        if name not in state and hasattr(obj, name):
+            delattr(obj, name)
+    for name, value in state.items():
+        setattr(obj, name, value)
+
+# Binary state format of MiniGridEnv.get_state. The version is bumped
+# whenever the format changes, and set_state keeps reading older versions.
+STATE_MAGIC = b'MGS'
+STATE_VERSION = 1
+
+# Magic, version, grid width and height, followed by the grid planes
+STATE_HEADER = struct.Struct('<3sBHH')
+# Agent position and direction, step count
+STATE_AGENT = struct.Struct('<hhBI')
+# Mersenne Twister position, Gaussian cache, followed by 624 uint32 keys
+STATE_RNG = struct.Struct('<IBd')
+
+def _small_array(values, dtype, shape):
+    return np.array(values, dtype=dtype).reshape(shape)
+
+def _reduce_array(a):
+    # Arrays in object attributes hold a few values (positions), which
+    # are much smaller stored as lists than with the NumPy pickle format
+    return _small_array, (a.ravel().tolist(), a.dtype.str, a.shape)
+
+class _StatePickler(pickle.Pickler):
+    """
+    Pickler for the attributes of the environment state. World objects
+    with per-instance state are replaced by their index in the object
+    table, and their states are written after the attributes.
+    """
+
+    dispatch_table = copyreg.dispatch_table.copy()
+    dispatch_table[np.ndarray] = _reduce_array
+
+    def __init__(self, file):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.objs = []
+        self.obj_idx = {}
+
+    def persistent_id(self, obj):
+        if not isinstance(obj, WorldObj):
+            return None
+        if isinstance(obj, FlyweightObj) and type(obj).__dictoffset__ == 0:
+            return None
+
+        idx = self.obj_idx.get(id(obj))
+        if idx is None:
+            idx = self.obj_idx[id(obj)] = len(self.objs)
+            self.objs.append(obj)
+        return (idx, type(obj))
+
+# Globals, besides world objects and the state classes of environments,
+# that pickled states can reference: the helpers used to pickle arrays and
+# shared objects, and the reconstructors of NumPy scalars
+STATE_GLOBALS = {
+    ('gym_minigrid.minigrid', '_small_array'),
+    ('gym_minigrid.minigrid', '_shared_obj'),
+    ('numpy', 'dtype'),
+    ('numpy.core.multiarray', 'scalar'),
+    ('numpy._core.multiarray', 'scalar'),
+}
+
+def find_state_class(module, name, classes):
+    """
+    Look up a global referenced by a pickled state. States can be read from
+    files, so instead of any global, only world object classes, the given
+    classes and STATE_GLOBALS are allowed, from modules already imported.
+    """
+
+    mod = sys.modules.get(module)
+    obj = getattr(mod, name, None) if mod is not None and '.' not in name else None
+
+    if obj is not None:
+        if (module, name) in STATE_GLOBALS:
+            return obj
+        if isinstance(obj, type) and (issubclass(obj, WorldObj) or obj in classes):
+            return obj
+
+    raise pickle.UnpicklingError('%s.%s is not allowed in a MiniGrid state' % (module, name))
+
+class _StateUnpickler(pickle.Unpickler):
+    """
+    Unpickler for the output of _StatePickler. Objects are created empty
+    when first referenced, and filled once their states are read.
+    """
+
+    def __init__(self, file, classes=()):
+        super().__init__(file)
+        self.objs = []
+        self.classes = classes
+
+    def find_class(self, module, name):
+        return find_state_class(module, name, self.classes)
+
+    def persistent_load(self, pid):
+        idx, cls = pid
+        if not (isinstance(cls, type) and issubclass(cls, WorldObj)):
+            raise pickle.UnpicklingError('invalid object reference in a MiniGrid state')
+        if idx == len(self.objs):
+            self.objs.append(cls.__new__(cls))
+        return self.objs[idx]
+
+class LazyObs(Mapping):
+    """
+    Observation returned by MiniGridEnv.step when lazy_obs is set. It
+    reads like the dictionary returned by gen_obs, but the image is only
+    generated when it is first accessed, then kept. The image must be read
+    before the environment changes state (the agent moves or turns, or the
+    grid changes), otherwise a RuntimeError is raised.
+    """
+
+    __slots__ = ('env', 'grid', 'key', 'image', 'direction', 'mission')
+
+    def __init__(self, env):
+        self.env = env
+        self.grid = env.grid
+        self.key = env.obs_key()
+        self.image = None
+        self.direction = env.agent_dir
+        self.mission = env.mission
+
+    def materialize(self):
+        """
+        Generate the image if it wasn't already, and return it
+        """
+
+        if self.image is None:
+            env = self.env
+            if env.grid is not self.grid or env.obs_key() != self.key:
+                raise RuntimeError(
+                    'lazy observation read after the environment changed state'
+                )
+            self.image = env.gen_obs_image()
+            self.env = None
+            self.grid = None
+
+        return self.image
+
+    def __getitem__(self, key):
+        if key == 'image':
+            return self.materialize()
+        if key == 'direction':
+            return self.direction
+        if key == 'mission':
+            return self.mission
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(('image', 'direction', 'mission'))
+
+    def __len__(self):
+        return 3
+
+# Thread pool running the blocking calls of the asyncio API
+_async_pool = None
+
+# Whether gym.utils.seeding has the helpers used by MiniGridEnv.seed to
+# reseed a generator in place
+_INPLACE_SEEDING = all(
+    hasattr(seeding, name)
+    for name in ('create_seed', 'hash_seed', '_int_list_from_bigint')
+)
+
+def run_async(func, *args):
+    """
+    Run a blocking function on the shared worker pool, returning an
+    asyncio future for its result. Must be called from a running event loop,
+    which requires Python 3.7 or later.
+    """
+
+    global _async_pool
+    if _async_pool is None:
+        _async_pool = ThreadPoolExecutor(
+            max_workers=max(4, os.cpu_count() or 1),
+            thread_name_prefix='minigrid'
+        )
+
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(_async_pool, func, *args)
+
 class MiniGridEnv(gym.Env):
     """
     2D grid world game environment
@@ -640,6 +1654,68 @@ class MiniGridEnv(gym.Env):
         'video.frames_per_second' : 10
     }
 
+    # Optional VisMaskCache used to memoize visibility masks. It can be
+    # set on a single environment, or on the class to share it between
+    # all environments
+    vis_cache = None
+
+    # Optional LevelCache used to restore levels instead of generating
+    # them, when resetting right after seeding. It can be set on a single
+    # environment, or on the class to share it between all environments
+    level_cache = None
+    reset_seed = None
+
+    # Optional LevelPrefetcher generating the levels of the next resets in
+    # the background, and slot of this environment in it
+    prefetcher = None
+    prefetch_slot = 0
+
+    # Object types ending the episode when the agent moves into them,
+    # mapped to whether reaching them is rewarded
+    forward_done = {'goal': True, 'lava': False}
+
+    # Tables of action handlers, by environment class and action
+    # enumeration, see _action_handlers
+    handler_tables = {}
+    _handlers = None
+
+    # When set, step returns a LazyObs whose image is only generated when
+    # it is read, for callers that discard most observations
+    lazy_obs = False
+
+    # Set by step_many while taking steps whose observation is discarded,
+    # so that overrides of step can skip generating it
+    discard_obs = False
+
+    # When set, place_obj draws positions in the whole rectangle and
+    # rejects them as rejection sampling did, reproducing the levels that
+    # earlier versions generated for each seed. Otherwise it samples
+    # directly among the free cells, which generates different levels.
+    compat_placement = True
+
+    # Attributes that change the level generated for a seed, besides the
+    # constructor arguments. They are part of the level keys and are set
+    # on the environments regenerating levels in other processes.
+    # Subclasses extend this with the options read by _gen_grid.
+    gen_attrs = ('compat_placement',)
+
+    # Attributes saved by clone_state along with the grid and the random
+    # number generator. Subclasses extend this with the attributes they
+    # update while stepping or resetting, including every attribute set by
+    # _gen_grid: level caches, prefetchers and level banks restore levels
+    # from these alone.
+    state_attrs = (
+        'agent_pos',
+        'agent_dir',
+        'carrying',
+        'step_count',
+        'mission'
+    )
+
+    # Classes, other than world objects, of the values held by the state
+    # attributes. Only these can be unpickled from a serialized state.
+    state_classes = ()
+
     # Enumeration of possible actions
     class Actions(IntEnum):
         # Turn left, turn right, move forward
@@ -713,13 +1789,73 @@ class MiniGridEnv(gym.Env):
         self.agent_pos = None
         self.agent_dir = None
 
+        # Last generated observation image, and the grid and agent state
+        # it was generated from
+        self._obs_grid = None
+        self._obs_key = None
+        self._obs_image = None
+
         # Initialize the RNG
         self.seed(seed=seed)
 
         # Initialize the state
         self.reset()
 
+    def __new__(cls, *args, **kwargs):
+        # Keep the constructor arguments, which identify levels along with
+        # the seed, see level_key
+        env = super().__new__(cls)
+        env.init_args = (args, tuple(sorted(kwargs.items())))
+        return env
+
+    def gen_config(self):
+        """
+        Get the values of the gen_attrs of this environment, as a tuple of
+        (name, value) pairs
+        """
+
+        return tuple((name, getattr(self, name)) for name in self.gen_attrs)
+
+    def level_key(self, seed):
+        """
+        Get the key of the level generated with a seed in a LevelCache, or
+        None if the constructor arguments can't be used as a key
+        """
+
+        key = (
+            type(self),
+            getattr(self, 'init_args', None),
+            self.gen_config(),
+            seed
+        )
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
     def reset(self):
+        # Levels generated right after seeding can be restored from the cache
+        seed = self.reset_seed
+        self.reset_seed = None
+
+        key = None
+        if self.level_cache is not None and seed is not None:
+            key = self.level_key(seed)
+
+        if key is not None:
+            blob = self.level_cache.get(key)
+            if blob is not None:
+                self.set_state(blob)
+                return self.gen_obs()
+
+        # Other levels come from the prefetcher, when there is one
+        if self.prefetcher is not None and seed is None:
+            seed, blob = self.prefetcher.next_level(self.prefetch_slot)
+            if blob is not None:
+                self.set_state(blob)
+                return self.gen_obs()
+
         # Current position and direction of the agent
         self.agent_pos = None
         self.agent_dir = None
@@ -733,6 +1869,11 @@ class MiniGridEnv(gym.Env):
         assert self.agent_pos is not None
         assert self.agent_dir is not None
 
+        # Keep the agent pose as plain ints, which step works with
+        x, y = self.agent_pos
+        self.agent_pos = (int(x), int(y))
+        self.agent_dir = int(self.agent_dir)
+
         # Check that the agent doesn't overlap with an object
         start_cell = self.grid.get(*self.agent_pos)
         assert start_cell is None or start_cell.can_overlap()
@@ -743,19 +1884,193 @@ class MiniGridEnv(gym.Env):
         # Step count since episode start
         self.step_count = 0
 
+        if key is not None:
+            self.level_cache.put(key, self.get_state())
+
         # Return first observation
         obs = self.gen_obs()
         return obs
 
     def seed(self, seed=1337):
-        # Seed the random number generator
-        self.np_random, _ = seeding.np_random(seed)
+        # Seed the random number generator. An existing generator is
+        # reseeded in place, which gives the same state as creating a new
+        # one with seeding.np_random, at a fraction of the cost. This needs
+        # private helpers of gym.utils.seeding, which later releases of gym
+        # removed, otherwise a new generator is created.
+        rng = getattr(self, 'np_random', None)
+        if _INPLACE_SEEDING and isinstance(rng, np.random.RandomState) and \
+                isinstance(seed, int) and seed >= 0:
+            rng.seed(seeding._int_list_from_bigint(seeding.hash_seed(seeding.create_seed(seed))))
+        else:
+            self.np_random, _ = seeding.np_random(seed)
+
+        # Seed of the next level, if it is generated right after seeding
+        self.reset_seed = seed
+
         return [seed]
 
     @property
     def steps_remaining(self):
         return self.max_steps - self.step_count
 
+    def state_hash(self):
+        """
+        Get a 64-bit hash of the environment state, combining the grid
+        hash with the agent position and direction and the carried object
+        """
+
+        num_cells = self.grid.width * self.grid.height
+        x, y = self.agent_pos
+
+        h = self.grid.hash()
+        h ^= zobrist_key(
+            num_cells + int(y) * self.grid.width + int(x),
+            OBJECT_TO_IDX['agent'],
+            0,
+            self.agent_dir
+        )
+        if self.carrying is not None:
+            h ^= zobrist_key(2 * num_cells, *self.carrying.encode())
+
+        return h
+
+    def clone_state(self):
+        """
+        Take a snapshot of the environment state, to be restored later
+        with restore_state. Objects are not copied: the snapshot keeps
+        references to them along with the values of their attributes, so
+        that restoring preserves object identity.
+        """
+
+        grid = self.grid
+
+        planes = grid.array.copy()
+        planes.flags.writeable = False
+
+        attrs = {}
+        for name in self.state_attrs:
+            if hasattr(self, name):
+                attrs[name] = _copy_value(getattr(self, name))
+
+        objs = {}
+        _collect_objs(list(grid.objs.values()), objs)
+        _collect_objs(list(attrs.values()), objs)
+        obj_states = tuple(
+            (obj, _get_obj_state(obj)) for obj in objs.values()
+        )
+
+        return EnvState(
+            grid=grid,
+            planes=planes,
+            objs=dict(grid.objs),
+            grid_hash=grid._hash,
+            obj_states=obj_states,
+            attrs=attrs,
+            rng_state=self.np_random.get_state()
+        )
+
+    def restore_state(self, state):
+        """
+        Restore a snapshot taken with clone_state
+        """
+
+        grid = state.grid
+        grid.array[...] = state.planes
+        grid.objs = dict(state.objs)
+        grid.touch_all()
+        grid._hash = state.grid_hash
+        self.grid = grid
+
+        for obj, obj_state in state.obj_states:
+            _set_obj_state(obj, obj_state)
+
+        for name, value in state.attrs.items():
+            setattr(self, name, _copy_value(value))
+
+        self.np_random.set_state(state.rng_state)
+
+    def get_state(self):
+        """
+        Serialize the environment state into a compact bytes blob, to be
+        restored with set_state, possibly in another process. The blob holds
+        the grid planes, the agent pose and step count, the random number
+        generator state, and the state attributes and objects with
+        per-instance state (such as doors and box contents), pickled
+        without the environment itself.
+        """
+
+        grid = self.grid
+        x, y = self.agent_pos
+        buf = io.BytesIO()
+
+        buf.write(STATE_HEADER.pack(STATE_MAGIC, STATE_VERSION, grid.width, grid.height))
+        buf.write(np.ascontiguousarray(grid.array).tobytes())
+        buf.write(STATE_AGENT.pack(int(x), int(y), self.agent_dir, self.step_count))
+
+        _, keys, pos, has_gauss, cached_gaussian = self.np_random.get_state()
+        buf.write(STATE_RNG.pack(pos, has_gauss, cached_gaussian))
+        buf.write(keys.astype('<u4').tobytes())
+
+        attrs = {
+            name: getattr(self, name)
+            for name in self.state_attrs
+            if name not in ('agent_pos', 'agent_dir', 'step_count') and hasattr(self, name)
+        }
+
+        # Object states can reference more objects, write them until all
+        # the objects referenced so far have been written
+        pickler = _StatePickler(buf)
+        pickler.dump((sorted(grid.objs.items()), attrs))
+        written = 0
+        while written < len(pickler.objs):
+            pickler.dump(_get_obj_state(pickler.objs[written]))
+            written += 1
+
+        return buf.getvalue()
+
+    def set_state(self, blob):
+        """
+        Restore the environment state from a blob produced by get_state.
+        The blob is unpickled, restricted to world objects and the classes
+        in state_classes, but it should still come from a trusted source.
+        """
+
+        buf = io.BytesIO(blob)
+
+        magic, version, width, height = STATE_HEADER.unpack(buf.read(STATE_HEADER.size))
+        if magic != STATE_MAGIC:
+            raise ValueError('not a MiniGrid state')
+        if version > STATE_VERSION:
+            raise ValueError('unsupported state version %d' % version)
+
+        planes = np.frombuffer(buf.read(width * height * 3), dtype='uint8')
+
+        x, y, agent_dir, step_count = STATE_AGENT.unpack(buf.read(STATE_AGENT.size))
+
+        pos, has_gauss, cached_gaussian = STATE_RNG.unpack(buf.read(STATE_RNG.size))
+        keys = np.frombuffer(buf.read(624 * 4), dtype='<u4').astype('uint32')
+
+        unpickler = _StateUnpickler(buf, self.state_classes)
+        grid_objs, attrs = unpickler.load()
+        read = 0
+        while read < len(unpickler.objs):
+            _set_obj_state(unpickler.objs[read], unpickler.load())
+            read += 1
+
+        grid = Grid(width, height)
+        grid.array[...] = planes.reshape(width, height, 3)
+        grid.objs = dict(grid_objs)
+        grid.touch_all()
+        self.grid = grid
+
+        self.agent_pos = (x, y)
+        self.agent_dir = agent_dir
+        self.step_count = step_count
+        for name, value in attrs.items():
+            setattr(self, name, value)
+
+        self.np_random.set_state(('MT19937', keys, pos, has_gauss, cached_gaussian))
+
     def __str__(self):
         """
         Produce a pretty string of the environment's grid along with the agent.
@@ -891,6 +2206,22 @@ class MiniGridEnv(gym.Env):
             self.np_random.randint(yLow, yHigh)
         )
 
+    def _free_cells(self, x0, y0, x1, y1):
+        """
+        Get the mask of the cells of a rectangle where an object can be
+        placed, indexed by position relative to its top-left corner
+        """
+
+        free = FREE_TYPES[self.grid.array[x0:x1, y0:y1, 0]]
+
+        # Don't place the object where the agent is
+        if self.agent_pos is not None:
+            ax, ay = (int(v) for v in self.agent_pos)
+            if x0 <= ax < x1 and y0 <= ay < y1:
+                free[ax - x0, ay - y0] = False
+
+        return free
+
     def place_obj(self,
         obj,
         top=None,
@@ -914,6 +2245,33 @@ class MiniGridEnv(gym.Env):
         if size is None:
             size = (self.grid.width, self.grid.height)
 
+        x0, y0 = top
+        x1 = min(top[0] + size[0], self.grid.width)
+        y1 = min(top[1] + size[1], self.grid.height)
+
+        free = self._free_cells(x0, y0, x1, y1)
+
+        if self.compat_placement:
+            pos = self._place_compat(free, x0, y0, x1, y1, reject_fn, max_tries)
+        else:
+            pos = self._place_free(free, x0, y0, reject_fn, max_tries)
+
+        self.grid.set(*pos, obj)
+
+        if obj is not None:
+            obj.init_pos = pos
+            obj.cur_pos = pos
+
+        return pos
+
+    def _place_compat(self, free, x0, y0, x1, y1, reject_fn, max_tries):
+        """
+        Draw positions in the rectangle until one is free, consuming the
+        random number generator exactly as rejection sampling did
+        """
+
+        # Number of candidate cells, counted on the first rejection
+        num_free = None
         num_tries = 0
 
         while True:
@@ -924,32 +2282,54 @@ class MiniGridEnv(gym.Env):
 
             num_tries += 1
 
-            pos = np.array((
-                self._rand_int(top[0], min(top[0] + size[0], self.grid.width)),
-                self._rand_int(top[1], min(top[1] + size[1], self.grid.height))
-            ))
+            x = self._rand_int(x0, x1)
+            y = self._rand_int(y0, y1)
 
-            # Don't place the object on top of another object
-            if self.grid.get(*pos) != None:
-                continue
+            if free[x - x0, y - y0]:
+                pos = np.array((x, y))
+                if not reject_fn or not reject_fn(self, pos):
+                    return pos
 
-            # Don't place the object where the agent is
-            if np.array_equal(pos, self.agent_pos):
-                continue
+                # Rejected cells are removed from the candidates, so that
+                # the filtering function is called at most once per cell
+                free[x - x0, y - y0] = False
+                if num_free is not None:
+                    num_free -= 1
 
-            # Check if there is a filtering criterion
-            if reject_fn and reject_fn(self, pos):
-                continue
+            if num_free is None:
+                num_free = int(np.count_nonzero(free))
 
-            break
+            # Sampling would never end without any candidate left
+            if num_free == 0 and max_tries == math.inf:
+                raise RecursionError('no free position in place_obj')
 
-        self.grid.set(*pos, obj)
+    def _place_free(self, free, x0, y0, reject_fn, max_tries):
+        """
+        Draw a position among the free cells of the rectangle, removing
+        the ones rejected by the filtering function
+        """
 
-        if obj is not None:
-            obj.init_pos = pos
-            obj.cur_pos = pos
+        xs, ys = np.nonzero(free)
+        xs = (xs + x0).tolist()
+        ys = (ys + y0).tolist()
+        num_cells = len(xs)
+        num_tries = 0
 
-        return pos
+        while True:
+            if num_cells == 0 or num_tries > max_tries:
+                raise RecursionError('no free position in place_obj')
+
+            num_tries += 1
+
+            k = self._rand_int(0, num_cells)
+            pos = np.array((xs[k], ys[k]))
+
+            if not reject_fn or not reject_fn(self, pos):
+                return pos
+
+            # Swap the rejected cell out of the candidates
+            num_cells -= 1
+            xs[k], ys[k] = xs[num_cells], ys[num_cells]
 
     def place_agent(
         self,
@@ -1091,71 +2471,202 @@ class MiniGridEnv(gym.Env):
 
         return obs_cell is not None and obs_cell.type == world_cell.type
 
+    def _action_handlers(self):
+        """
+        Get the table mapping action values to the methods applying them,
+        built once per environment class and action enumeration
+        """
+
+        key = (type(self), self.actions)
+        handlers = MiniGridEnv.handler_tables.get(key)
+
+        if handlers is None:
+            handlers = {}
+            for action in self.actions:
+                handler = getattr(type(self), '_act_' + action.name, None)
+                if handler is not None:
+                    handlers[int(action)] = handler
+            MiniGridEnv.handler_tables[key] = handlers
+
+        return handlers
+
+    # Action handlers of MiniGridEnv.step. They get the position in front
+    # of the agent and its contents, and return None, or the reward and
+    # done flag when the action ends the episode.
+
+    def _act_left(self, fwd_pos, fwd_cell):
+        self.agent_dir -= 1
+        if self.agent_dir < 0:
+            self.agent_dir += 4
+
+    def _act_right(self, fwd_pos, fwd_cell):
+        self.agent_dir = (self.agent_dir + 1) % 4
+
+    def _act_forward(self, fwd_pos, fwd_cell):
+        if fwd_cell is None:
+            self.agent_pos = fwd_pos
+            return None
+
+        if fwd_cell.can_overlap():
+            self.agent_pos = fwd_pos
+
+        rewarded = self.forward_done.get(fwd_cell.type)
+        if rewarded is None:
+            return None
+        return (self._reward() if rewarded else 0), True
+
+    def _act_pickup(self, fwd_pos, fwd_cell):
+        if fwd_cell and fwd_cell.can_pickup():
+            if self.carrying is None:
+                self.carrying = fwd_cell
+                self.carrying.cur_pos = np.array([-1, -1])
+                self.grid.set(*fwd_pos, None)
+
+    def _act_drop(self, fwd_pos, fwd_cell):
+        if not fwd_cell and self.carrying:
+            self.grid.set(*fwd_pos, self.carrying)
+            self.carrying.cur_pos = np.array(fwd_pos)
+            self.carrying = None
+
+    def _act_toggle(self, fwd_pos, fwd_cell):
+        if fwd_cell and fwd_cell.toggle(self, fwd_pos):
+            self.grid.sync(*fwd_pos, fwd_cell)
+
+    def _act_done(self, fwd_pos, fwd_cell):
+        # Done action (not used by default)
+        pass
+
     def step(self, action):
         self.step_count += 1
 
         reward = 0
         done = False
 
-        # Get the position in front of the agent
-        fwd_pos = self.front_pos
+        handlers = self._handlers
+        if handlers is None:
+            handlers = self._handlers = self._action_handlers()
+
+        try:
+            handler = handlers[action]
+        except (KeyError, TypeError):
+            handler = handlers.get(int(action))
+            assert handler is not None, "unknown action"
+
+        # Get the position in front of the agent, with plain ints
+        assert self.agent_dir >= 0 and self.agent_dir < 4
+        ax, ay = self.agent_pos
+        dx, dy = DIR_TO_TUPLE[self.agent_dir]
+        fwd_pos = (ax + dx, ay + dy)
 
         # Get the contents of the cell in front of the agent
         fwd_cell = self.grid.get(*fwd_pos)
 
-        # Rotate left
-        if action == self.actions.left:
-            self.agent_dir -= 1
-            if self.agent_dir < 0:
-                self.agent_dir += 4
-
-        # Rotate right
-        elif action == self.actions.right:
-            self.agent_dir = (self.agent_dir + 1) % 4
-
-        # Move forward
-        elif action == self.actions.forward:
-            if fwd_cell == None or fwd_cell.can_overlap():
-                self.agent_pos = fwd_pos
-            if fwd_cell != None and fwd_cell.type == 'goal':
-                done = True
-                reward = self._reward()
-            if fwd_cell != None and fwd_cell.type == 'lava':
-                done = True
+        result = handler(self, fwd_pos, fwd_cell)
+        if result is not None:
+            reward, done = result
 
-        # Pick up an object
-        elif action == self.actions.pickup:
-            if fwd_cell and fwd_cell.can_pickup():
-                if self.carrying is None:
-                    self.carrying = fwd_cell
-                    self.carrying.cur_pos = np.array([-1, -1])
-                    self.grid.set(*fwd_pos, None)
+        if self.step_count >= self.max_steps:
+            done = True
 
-        # Drop an object
-        elif action == self.actions.drop:
-            if not fwd_cell and self.carrying:
-                self.grid.set(*fwd_pos, self.carrying)
-                self.carrying.cur_pos = fwd_pos
-                self.carrying = None
+        if self.lazy_obs and type(self).gen_obs is MiniGridEnv.gen_obs:
+            obs = LazyObs(self)
+        else:
+            obs = self.gen_obs()
 
-        # Toggle/activate an object
-        elif action == self.actions.toggle:
-            if fwd_cell:
-                fwd_cell.toggle(self, fwd_pos)
+        return obs, reward, done, {}
 
-        # Done action (not used by default)
-        elif action == self.actions.done:
-            pass
+    def step_many(self, actions):
+        """
+        Apply a sequence of actions, stopping at the end of the episode.
+        Only the final observation is generated. Returns it along with
+        arrays of the rewards and done flags of the steps taken, which may
+        be fewer than the actions, and the info of the last step.
+        """
 
-        else:
-            assert False, "unknown action"
+        actions = list(actions)
+        lazy_obs = self.lazy_obs
+        self.lazy_obs = True
+
+        rewards = []
+        dones = []
+        obs = None
+        info = {}
+
+        try:
+            for k, action in enumerate(actions):
+                # The observation is only kept for the last action, or for
+                # a step ending the episode
+                self.discard_obs = k < len(actions) - 1
+                obs, reward, done, info = self.step(action)
+                rewards.append(reward)
+                dones.append(done)
+                if done:
+                    break
+        finally:
+            self.lazy_obs = lazy_obs
+            self.discard_obs = False
+
+        if obs is None:
+            obs = self.gen_obs()
+        elif isinstance(obs, LazyObs) and not lazy_obs:
+            obs = dict(obs)
+
+        return obs, np.array(rewards, dtype=np.float64), np.array(dones, dtype=bool), info
+
+    async def areset(self):
+        """
+        Coroutine version of reset, running on a worker thread so that the
+        event loop is not blocked
+        """
 
-        if self.step_count >= self.max_steps:
-            done = True
+        return await run_async(self.reset)
 
-        obs = self.gen_obs()
+    async def astep(self, action):
+        """
+        Coroutine version of step, running on a worker thread so that the
+        event loop is not blocked. Wrappers forward this to the unwrapped
+        environment, so call it on the environment whose step is wanted.
+        """
 
-        return obs, reward, done, {}
+        return await run_async(self.step, action)
+
+    def gen_obs_planes(self):
+        """
+        Get the planes of the sub-grid observed by the agent, rotated so
+        that the agent is at the bottom center, facing up. This is a
+        strided view of the padded grid planes, no data is copied.
+        """
+
+        topX, topY, botX, botY = self.get_view_exts()
+
+        buf, pad = self.grid.padded(self.agent_view_size)
+        view = buf[topX+pad:botX+pad, topY+pad:botY+pad]
+
+        # Rotate the view to the left once more than the agent direction
+        return np.rot90(view, k=-(self.agent_dir + 1))
+
+    def gen_vis_mask(self, planes):
+        """
+        Compute which cells of the sub-grid observed by the agent are
+        actually visible, given the planes from gen_obs_planes
+        """
+
+        sz = self.agent_view_size
+
+        if self.see_through_walls:
+            return np.ones(shape=(sz, sz), dtype=bool)
+
+        see_behind = see_behind_planes(planes)
+        for i, j, v in self.grid.custom_occluders():
+            coords = self.relative_coords(i, j)
+            if coords is not None:
+                see_behind[coords] = v
+
+        return vis_mask_from_occluders(
+            see_behind,
+            (sz // 2, sz - 1),
+            self.vis_cache
+        )
 
     def gen_obs_grid(self):
         """
@@ -1164,19 +2675,21 @@ class MiniGridEnv(gym.Env):
         cells the agent can actually see.
         """
 
-        topX, topY, botX, botY = self.get_view_exts()
+        planes = self.gen_obs_planes()
+        vis_mask = self.gen_vis_mask(planes)
 
-        grid = self.grid.slice(topX, topY, self.agent_view_size, self.agent_view_size)
+        sz = self.agent_view_size
+        grid = Grid(sz, sz)
+        grid.array = planes.copy()
 
-        for i in range(self.agent_dir + 1):
-            grid = grid.rotate_left()
+        # Cells the agent can't see are empty
+        grid.array[np.logical_not(vis_mask)] = EMPTY_CELL
 
-        # Process occluders and visibility
-        # Note that this incurs some performance cost
-        if not self.see_through_walls:
-            vis_mask = grid.process_vis(agent_pos=(self.agent_view_size // 2 , self.agent_view_size - 1))
-        else:
-            vis_mask = np.ones(shape=(grid.width, grid.height), dtype=np.bool)
+        # Bring along the visible objects with per-instance behaviour
+        for idx, v in self.grid.objs.items():
+            coords = self.relative_coords(idx % self.grid.width, idx // self.grid.width)
+            if coords is not None and vis_mask[coords]:
+                grid.objs[coords[1] * sz + coords[0]] = v
 
         # Make it so the agent sees what it's carrying
         # We do this by placing the carried object at the agent's position
@@ -1189,15 +2702,60 @@ class MiniGridEnv(gym.Env):
 
         return grid, vis_mask
 
+    def obs_key(self):
+        """
+        Key of the state the observation image depends on: the grid version
+        and the agent. The grid object itself must be compared separately.
+        """
+
+        return (
+            self.grid.version,
+            tuple(self.agent_pos),
+            self.agent_dir,
+            self.carrying,
+            self.agent_view_size,
+            self.see_through_walls
+        )
+
+    def gen_obs_image(self):
+        """
+        Generate the image of the agent's view
+        """
+
+        # The image only depends on the grid and on the agent, so it can
+        # be reused when neither of them changed since the last call,
+        # for instance when the agent bumps into a wall
+        obs_key = self.obs_key()
+
+        if self._obs_grid is self.grid and self._obs_key == obs_key:
+            image = self._obs_image.copy()
+        else:
+            planes = self.gen_obs_planes()
+            vis_mask = self.gen_vis_mask(planes)
+
+            # Encode the partially observable view into a numpy array
+            image = planes.copy()
+            image[np.logical_not(vis_mask)] = 0
+
+            # Make it so the agent sees what it's carrying
+            agent_pos = self.agent_view_size // 2, self.agent_view_size - 1
+            if self.carrying:
+                image[agent_pos] = self.carrying.encode()
+            else:
+                image[agent_pos] = EMPTY_CELL
+
+            self._obs_grid = self.grid
+            self._obs_key = obs_key
+            self._obs_image = image.copy()
+
+        return image
+
     def gen_obs(self):
         """
         Generate the agent's view (partially observable, low-resolution encoding)
         """
 
-        grid, vis_mask = self.gen_obs_grid()
-
-        # Encode the partially observable view into a numpy array
-        image = grid.encode(vis_mask)
+        image = self.gen_obs_image()
 
         assert hasattr(self, 'mission'), "environments must define a textual mission string"
 
@@ -1307,7 +2865,7 @@ class MiniGridEnv(gym.Env):
         r.pop()
 
         # Compute which cells are visible to the agent
-        _, vis_mask = self.gen_obs_grid()
+        vis_mask = self.gen_vis_mask(self.gen_obs_planes())
 
         # Compute the absolute coordinates of the bottom-left corner
         # of the agent's view area
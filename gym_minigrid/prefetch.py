@@ -0,0 +1,137 @@
+import threading
+from collections import deque
+
+def _prefetch_worker(remote, parent_remote, cls, init_args, gen_config, seeds, queue_size):
+    """
+    Generate the levels of each slot for its sequence of seeds, keeping at
+    most queue_size levels of a slot ahead of what was taken
+    """
+
+    parent_remote.close()
+
+    args, kwargs = init_args
+    env = cls(*args, **dict(kwargs))
+
+    # Generate the same levels as the environment the prefetcher is for
+    for name, value in gen_config:
+        setattr(env, name, value)
+    seeds = [iter(slot_seeds) for slot_seeds in seeds]
+
+    # Slots to generate a level for, one entry per level
+    pending = deque()
+    for k in range(0, queue_size):
+        pending.extend(range(0, len(seeds)))
+
+    try:
+        while True:
+            # Wait for levels to be taken when all queues are full
+            while not pending or remote.poll():
+                cmd, slot = remote.recv()
+                if cmd == 'close':
+                    return
+                pending.append(slot)
+
+            slot = pending.popleft()
+            seed = next(seeds[slot], None)
+            if seed is None:
+                # The seeds of this slot are exhausted
+                remote.send((slot, None, None))
+                continue
+
+            env.seed(seed)
+            env.reset()
+            remote.send((slot, seed, env.get_state()))
+
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        env.close()
+        remote.close()
+
+class LevelPrefetcher:
+    """
+    Generates levels in a background process, ahead of the resets that
+    need them. Each slot (one environment) has its own sequence of seeds,
+    and a bounded queue of levels generated for its next seeds, stored as
+    get_state blobs.
+
+    An environment with a prefetcher set takes the next level of its slot on
+    each reset that does not directly follow a call to seed, so that
+    resetting is a state restore. The level of a seed is the same as the one
+    generated by seeding and resetting the environment, the prefetcher only
+    fixes the seed of each episode.
+    """
+
+    def __init__(self, env, seeds, queue_size=4, context=None):
+        """
+        env is an environment, whose class, constructor arguments and
+        gen_attrs are used to create the environment generating the
+        levels. seeds is a list holding the seeds of each slot, as
+        picklable iterables such as ranges.
+        """
+
+        import multiprocessing as mp
+
+        assert queue_size > 0
+
+        env = env.unwrapped
+        self.num_slots = len(seeds)
+        self.levels = [deque() for slot in range(0, self.num_slots)]
+        self.lock = threading.Lock()
+
+        ctx = mp.get_context(context)
+        self.remote, worker_remote = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_prefetch_worker,
+            args=(
+                worker_remote,
+                self.remote,
+                type(env),
+                env.init_args,
+                env.gen_config(),
+                list(seeds),
+                queue_size
+            ),
+            daemon=True
+        )
+        self.process.start()
+        worker_remote.close()
+
+        self.closed = False
+
+    def next_level(self, slot=0):
+        """
+        Get the seed and state blob of the next level of a slot, waiting
+        for it to be generated if needed. Both are None once the seeds of
+        the slot are exhausted.
+        """
+
+        with self.lock:
+            levels = self.levels[slot]
+            while not levels:
+                level_slot, seed, blob = self.remote.recv()
+                self.levels[level_slot].append((seed, blob))
+
+            seed, blob = levels.popleft()
+            self.remote.send(('take', slot))
+
+        return seed, blob
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.remote.send(('close', None))
+
+            # The worker may be blocked sending a level, read until it exits
+            while True:
+                self.remote.recv()
+        except (EOFError, OSError):
+            pass
+        self.process.join()
+        self.remote.close()
+        self.closed = True
+
+    def __del__(self):
+        if not getattr(self, 'closed', True):
+            self.close()
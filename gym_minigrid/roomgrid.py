@@ -73,6 +73,42 @@ class Room:
         return True
 
 
+class RoomSets:
+    """
+    Union-find structure over the rooms of a grid, indexed by
+    j * num_cols + i, tracking the sets of rooms connected to each other
+    by doors or removed walls
+    """
+
+    def __init__(self, num_rooms):
+        self.parent = list(range(0, num_rooms))
+        self.num_sets = num_rooms
+
+    def find(self, idx):
+        parent = self.parent
+        while parent[idx] != idx:
+            # Path halving
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
+
+    def union(self, a, b):
+        """
+        Merge the sets of two rooms, returning False if they were already
+        connected
+        """
+
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return False
+        self.parent[b] = a
+        self.num_sets -= 1
+        return True
+
+    def connected(self, a, b):
+        return self.find(a) == self.find(b)
+
 class LightSwitch(WorldObj):
     def __init__(self,
                  room,
@@ -107,14 +143,16 @@ class RoomGrid(MiniGridEnv):
     This is meant to serve as a base class for other environments.
     """
 
+    state_attrs = MiniGridEnv.state_attrs + ('room_grid', 'room_sets')
+    state_classes = MiniGridEnv.state_classes + (Room, RoomSets)
+
     def __init__(
         self,
         room_size=7,
         num_rows=3,
         num_cols=3,
         max_steps=100,
-        seed=0,
-        actions=None
+        seed=0
     ):
         assert room_size > 0
         assert room_size >= 3
@@ -135,8 +173,7 @@ class RoomGrid(MiniGridEnv):
             height=height,
             max_steps=max_steps,
             see_through_walls=False,
-            seed=seed,
-            actions=actions
+            seed=seed
         )
 
     def room_from_pos(self, x, y):
@@ -158,12 +195,26 @@ class RoomGrid(MiniGridEnv):
         assert j < self.num_rows
         return self.room_grid[j][i]
 
+    def _join_rooms(self, i, j, wall_idx):
+        """
+        Record that room (i, j) is connected to its neighbor along a wall
+        """
+
+        dx, dy = DIR_TO_TUPLE[wall_idx]
+        self.room_sets.union(
+            j * self.num_cols + i,
+            (j + dy) * self.num_cols + (i + dx)
+        )
+
     def _gen_grid(self, width, height):
         # Create the grid
         self.grid = Grid(width, height)
 
         self.room_grid = []
 
+        # No room is connected to another yet
+        self.room_sets = RoomSets(self.num_rows * self.num_cols)
+
         # For each row of rooms
         for j in range(0, self.num_rows):
             row = []
@@ -310,6 +361,7 @@ class RoomGrid(MiniGridEnv):
         neighbor = room.neighbors[door_idx]
         room.doors[door_idx] = door
         neighbor.doors[(door_idx+2) % 4] = door
+        self._join_rooms(i, j, door_idx)
 
         return door, pos
 
@@ -325,6 +377,7 @@ class RoomGrid(MiniGridEnv):
         assert room.neighbors[wall_idx], "invalid wall"
 
         neighbor = room.neighbors[wall_idx]
+        self._join_rooms(i, j, wall_idx)
 
         tx, ty = room.top
         w, h = room.size
@@ -376,53 +429,92 @@ class RoomGrid(MiniGridEnv):
         starting position
         """
 
-        start_room = self.room_from_pos(*self.agent_pos)
+        if not self.compat_placement:
+            return self._connect_sets(door_colors)
 
         added_doors = []
 
-        def find_reach():
-            reach = set()
-            stack = [start_room]
-            while len(stack) > 0:
-                room = stack.pop()
-                if room in reach:
+        num_itrs = 0
+
+        # The loop only draws integers, which are served in bulk
+        with RandIntStream(self):
+            while True:
+                # This is to handle rare situations where random sampling
+                # produces a level that cannot be connected, producing in an
+                # infinite loop
+                if num_itrs > max_itrs:
+                    raise RecursionError('connect_all failed')
+                num_itrs += 1
+
+                # If all rooms are connected, and so reachable, stop
+                if self.room_sets.num_sets == 1:
+                    break
+
+                # Pick a random room and door position
+                i = self._rand_int(0, self.num_cols)
+                j = self._rand_int(0, self.num_rows)
+                k = self._rand_int(0, 4)
+                room = self.get_room(i, j)
+
+                # If there is already a door there, skip
+                if not room.door_pos[k] or room.doors[k]:
                     continue
-                reach.add(room)
-                for i in range(0, 4):
-                    if room.doors[i]:
-                        stack.append(room.neighbors[i])
-            return reach
 
-        num_itrs = 0
+                if room.locked or room.neighbors[k].locked:
+                    continue
 
-        while True:
-            # This is to handle rare situations where random sampling produces
-            # a level that cannot be connected, producing in an infinite loop
-            if num_itrs > max_itrs:
-                raise RecursionError('connect_all failed')
-            num_itrs += 1
-
-            # If all rooms are reachable, stop
-            reach = find_reach()
-            if len(reach) == self.num_rows * self.num_cols:
-                break
+                color = self._rand_elem(door_colors)
+                door, _ = self.add_door(i, j, k, color, False)
+                added_doors.append(door)
 
-            # Pick a random room and door position
-            i = self._rand_int(0, self.num_cols)
-            j = self._rand_int(0, self.num_rows)
-            k = self._rand_int(0, 4)
-            room = self.get_room(i, j)
+        return added_doors
 
-            # If there is already a door there, skip
-            if not room.door_pos[k] or room.doors[k]:
-                continue
+    def _connect_sets(self, door_colors):
+        """
+        Add doors between random pairs of neighboring rooms that are not
+        connected yet, until all rooms are. Each wall where a door could go
+        is drawn at most once.
+        """
 
-            if room.locked or room.neighbors[k].locked:
-                continue
+        # Walls where a door can be added, as room and wall index. Walls
+        # to the right and below each room cover all pairs of neighbors.
+        walls = [
+            (i, j, k)
+            for j in range(0, self.num_rows)
+            for i in range(0, self.num_cols)
+            for k in (0, 1)
+            if self.room_grid[j][i].door_pos[k]
+            and not self.room_grid[j][i].doors[k]
+            and not self.room_grid[j][i].locked
+            and not self.room_grid[j][i].neighbors[k].locked
+        ]
+        num_walls = len(walls)
+
+        added_doors = []
+
+        with RandIntStream(self):
+            while self.room_sets.num_sets > 1:
+                if num_walls == 0:
+                    raise RecursionError('connect_all failed')
+
+                idx = self._rand_int(0, num_walls)
+                i, j, k = walls[idx]
+
+                # Swap the wall out of the candidates
+                num_walls -= 1
+                walls[idx] = walls[num_walls]
+
+                # Doors between connected rooms are not needed
+                dx, dy = DIR_TO_TUPLE[k]
+                if self.room_sets.connected(
+                    j * self.num_cols + i,
+                    (j + dy) * self.num_cols + (i + dx)
+                ):
+                    continue
 
-            color = self._rand_elem(door_colors)
-            door, _ = self.add_door(i, j, k, color, False)
-            added_doors.append(door)
+                color = self._rand_elem(door_colors)
+                door, _ = self.add_door(i, j, k, color, False)
+                added_doors.append(door)
 
         return added_doors
 
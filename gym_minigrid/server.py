@@ -0,0 +1,359 @@
+import socket
+import struct
+import numpy as np
+from gym import spaces
+from optparse import OptionParser
+
+from .register import env_list
+from .vector import make_vec_env, wait_readable
+
+# Binary protocol. Every message is a header holding an opcode and the
+# payload length, followed by the payload. Integers are little-endian.
+HEADER = struct.Struct('<BI')
+
+# Client requests
+OP_INFO = 0
+OP_RESET = 1
+OP_STEP = 2
+OP_CLOSE = 3
+
+# Server responses
+OP_INFO_REPLY = 128
+OP_OBS = 129
+OP_ERROR = 255
+
+# Info reply: number of environments, number of actions, image shape
+INFO = struct.Struct('<II3H')
+
+# Observations, for N environments of image shape (w, h, 3):
+# - N * w * h * 3 bytes of images
+# - N bytes of directions
+# - N float64 rewards and N bytes of done flags
+# - one image per done environment, the last view of its episode
+# - the number of changed missions, then for each one its slot, its
+#   length and its UTF-8 encoding
+
+def _recv_exact(sock, size):
+    """
+    Receive exactly size bytes from a socket
+    """
+
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError('connection closed')
+        received += n
+    return buf
+
+def _recv_msg(sock):
+    op, size = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    return op, _recv_exact(sock, size)
+
+def _send_msg(sock, op, payload=b''):
+    sock.sendall(HEADER.pack(op, len(payload)) + payload)
+
+def _make_socket(address):
+    """
+    Create a socket for an address, either the path of a Unix-domain
+    socket or a (host, port) pair, where the host must be local
+    """
+
+    if isinstance(address, str):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    host, port = address
+    assert host in ('localhost', '127.0.0.1'), 'only local addresses are supported'
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+class EnvServer:
+    """
+    Server hosting a pool of environments of a registered id behind a
+    local socket. Clients step all the environments of the pool at once
+    with batched binary requests, see EnvClient.
+    """
+
+    def __init__(self, env_id, num_envs, address, seed=0):
+        assert env_id in env_list, 'unknown environment %s' % env_id
+
+        self.vec_env = make_vec_env(env_id, num_envs, seed=seed)
+        self.num_envs = num_envs
+        self.address = address
+
+        self.sock = _make_socket(address)
+        if not isinstance(address, str):
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(address)
+        self.sock.listen(1)
+
+        # Bound address, with the port picked by the system when it is 0
+        if not isinstance(address, str):
+            self.address = self.sock.getsockname()
+
+        # Missions last sent to the client
+        self.missions = None
+
+    def _encode_obs(self, obs, rewards, dones, infos):
+        n = self.num_envs
+        parts = [
+            np.ascontiguousarray(obs['image'], dtype='uint8').tobytes(),
+            np.asarray(obs['direction'], dtype='uint8').tobytes(),
+            np.asarray(rewards, dtype='<f8').tobytes(),
+            np.asarray(dones, dtype='uint8').tobytes(),
+        ]
+        for i in np.flatnonzero(dones):
+            parts.append(np.ascontiguousarray(infos[i]['terminal_image']).tobytes())
+
+        changed = [
+            (i, mission) for i, mission in enumerate(obs['mission'])
+            if self.missions is None or self.missions[i] != mission
+        ]
+        self.missions = list(obs['mission'])
+        parts.append(struct.pack('<I', len(changed)))
+        for i, mission in changed:
+            data = mission.encode('utf-8')
+            parts.append(struct.pack('<II', i, len(data)))
+            parts.append(data)
+
+        return b''.join(parts)
+
+    def handle(self, conn):
+        """
+        Serve the requests of a connected client until it disconnects
+        """
+
+        n = self.num_envs
+        image_shape = self.vec_env.single_observation_space.spaces['image'].shape
+        self.missions = None
+
+        while True:
+            try:
+                op, payload = _recv_msg(conn)
+            except ConnectionError:
+                return
+
+            if op == OP_INFO:
+                num_actions = self.vec_env.single_action_space.n
+                _send_msg(conn, OP_INFO_REPLY, INFO.pack(n, num_actions, *image_shape))
+
+            elif op == OP_RESET:
+                obs = self.vec_env.reset()
+                dones = np.zeros(n, dtype=bool)
+                _send_msg(conn, OP_OBS, self._encode_obs(obs, np.zeros(n), dones, None))
+
+            elif op == OP_STEP:
+                if len(payload) != n:
+                    _send_msg(conn, OP_ERROR, b'expected one action per environment')
+                    continue
+                actions = np.frombuffer(payload, dtype='uint8')
+                try:
+                    obs, rewards, dones, infos = self.vec_env.step(actions)
+                except Exception as e:
+                    message = str(e) or type(e).__name__
+                    _send_msg(conn, OP_ERROR, message.encode('utf-8'))
+                    continue
+                _send_msg(conn, OP_OBS, self._encode_obs(obs, rewards, dones, infos))
+
+            elif op == OP_CLOSE:
+                return
+
+            else:
+                _send_msg(conn, OP_ERROR, b'unknown opcode')
+
+    def serve_forever(self):
+        """
+        Serve clients one after the other
+        """
+
+        while True:
+            conn, _ = self.sock.accept()
+            with conn:
+                self.handle(conn)
+
+    def serve_one(self):
+        """
+        Serve a single client, then return
+        """
+
+        conn, _ = self.sock.accept()
+        with conn:
+            self.handle(conn)
+
+    def close(self):
+        self.sock.close()
+        self.vec_env.close()
+        if isinstance(self.address, str):
+            import os
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+
+class EnvClient:
+    """
+    Client of an EnvServer, exposing the same API as the vector
+    environments of gym_minigrid.vector
+    """
+
+    def __init__(self, address):
+        self.sock = _make_socket(address)
+        self.sock.connect(address)
+
+        _send_msg(self.sock, OP_INFO)
+        op, payload = _recv_msg(self.sock)
+        assert op == OP_INFO_REPLY
+        num_envs, num_actions, w, h, c = INFO.unpack(payload)
+
+        self.num_envs = num_envs
+        self.image_shape = (w, h, c)
+        self.single_action_space = spaces.Discrete(num_actions)
+        self.single_observation_space = spaces.Dict({
+            'image': spaces.Box(low=0, high=255, shape=self.image_shape, dtype='uint8')
+        })
+        self.missions = [''] * num_envs
+        self.waiting = False
+
+    def _decode_obs(self, payload):
+        n = self.num_envs
+        image_size = int(np.prod(self.image_shape))
+        offset = 0
+
+        def take(dtype, count):
+            nonlocal offset
+            array = np.frombuffer(payload, dtype=dtype, count=count, offset=offset)
+            offset += array.nbytes
+            return array
+
+        images = take('uint8', n * image_size).reshape((n,) + self.image_shape)
+        directions = take('uint8', n).astype('int64')
+        rewards = take('<f8', n)
+        dones = take('uint8', n).astype(bool)
+
+        infos = [{} for i in range(0, n)]
+        for i in np.flatnonzero(dones):
+            infos[i]['terminal_image'] = take('uint8', image_size).reshape(self.image_shape)
+
+        num_changed, = struct.unpack_from('<I', payload, offset)
+        offset += 4
+        for k in range(0, num_changed):
+            i, size = struct.unpack_from('<II', payload, offset)
+            offset += 8
+            self.missions[i] = bytes(payload[offset:offset+size]).decode('utf-8')
+            offset += size
+
+        obs = {
+            'image': images,
+            'direction': directions,
+            'mission': list(self.missions)
+        }
+        return obs, rewards, dones, infos
+
+    def _recv_obs(self):
+        op, payload = _recv_msg(self.sock)
+        if op == OP_ERROR:
+            raise RuntimeError(bytes(payload).decode('utf-8'))
+        assert op == OP_OBS
+        return self._decode_obs(payload)
+
+    def reset(self):
+        assert not self.waiting
+        _send_msg(self.sock, OP_RESET)
+        obs, _, _, _ = self._recv_obs()
+        return obs
+
+    def step_async(self, actions):
+        assert not self.waiting
+        actions = np.asarray(actions, dtype='uint8')
+        assert actions.shape == (self.num_envs,)
+        _send_msg(self.sock, OP_STEP, actions.tobytes())
+        self.waiting = True
+
+    def step_wait(self):
+        assert self.waiting
+        self.waiting = False
+        return self._recv_obs()
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    async def areset(self):
+        assert not self.waiting
+        _send_msg(self.sock, OP_RESET)
+        await wait_readable([self.sock])
+        obs, _, _, _ = self._recv_obs()
+        return obs
+
+    async def astep(self, actions):
+        """
+        Coroutine version of step, letting the event loop run while the
+        server steps the environments
+        """
+
+        self.step_async(actions)
+        await wait_readable([self.sock])
+        return self.step_wait()
+
+    def close(self):
+        if self.waiting:
+            self.step_wait()
+        _send_msg(self.sock, OP_CLOSE)
+        self.sock.close()
+
+def main():
+    parser = OptionParser()
+    parser.add_option(
+        "-e",
+        "--env-name",
+        dest="env_name",
+        help="gym environment to load",
+        default='MiniGrid-DoorKey-8x8-v0'
+    )
+    parser.add_option(
+        "-n",
+        "--num-envs",
+        dest="num_envs",
+        type="int",
+        help="number of environments in the pool",
+        default=64
+    )
+    parser.add_option(
+        "--socket",
+        dest="socket",
+        help="path of the Unix-domain socket to listen on",
+        default=None
+    )
+    parser.add_option(
+        "--port",
+        dest="port",
+        type="int",
+        help="localhost TCP port to listen on",
+        default=None
+    )
+    parser.add_option(
+        "--seed",
+        dest="seed",
+        type="int",
+        help="seed of the first environment",
+        default=0
+    )
+    (options, args) = parser.parse_args()
+
+    if options.socket is not None:
+        address = options.socket
+    else:
+        address = ('127.0.0.1', 7450 if options.port is None else options.port)
+
+    server = EnvServer(options.env_name, options.num_envs, address, seed=options.seed)
+    print('serving %d %s environments on %s' % (options.num_envs, options.env_name, server.address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+if __name__ == "__main__":
+    main()
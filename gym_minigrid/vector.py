@@ -0,0 +1,903 @@
+import asyncio
+import numpy as np
+import gym
+
+from .minigrid import OBJECT_TO_IDX, DIR_TO_VEC, EMPTY_CELL, WALL_CELL
+from .minigrid import MiniGridEnv, _fill_right, _fill_left, run_async
+from .prefetch import LevelPrefetcher
+from .envs.empty import EmptyEnv
+from .envs.doorkey import DoorKeyEnv
+from .envs.fourrooms import FourRoomsEnv
+from .envs.crossing import CrossingEnv
+
+# Encoded object types used by the vectorized dynamics
+EMPTY = OBJECT_TO_IDX['empty']
+WALL = OBJECT_TO_IDX['wall']
+DOOR = OBJECT_TO_IDX['door']
+KEY = OBJECT_TO_IDX['key']
+BOX = OBJECT_TO_IDX['box']
+GOAL = OBJECT_TO_IDX['goal']
+LAVA = OBJECT_TO_IDX['lava']
+
+# Object types the agent can walk over, doors depend on their state
+CAN_OVERLAP = np.zeros(256, dtype=bool)
+CAN_OVERLAP[[EMPTY, OBJECT_TO_IDX['floor'], GOAL, LAVA]] = True
+
+# Object types the agent can pick up
+CAN_PICKUP = np.zeros(256, dtype=bool)
+CAN_PICKUP[[KEY, OBJECT_TO_IDX['ball'], BOX]] = True
+
+# Direction vectors as an array indexed by direction
+DIR_VECS = np.array(DIR_TO_VEC)
+
+def view_offsets(view_size):
+    """
+    Offsets from the agent position of the cells of its view, in grid
+    coordinates. Returns two (4, view_size, view_size) arrays indexed by
+    agent direction, then by view coordinates, with the agent at the
+    bottom center of the view facing up, as in MiniGridEnv.gen_obs.
+    """
+
+    i = np.arange(view_size)[:, None]
+    j = np.arange(view_size)[None, :]
+
+    # Distance in front of the agent, and to its right
+    fwd = view_size - 1 - j
+    right = i - view_size // 2
+
+    dx = np.empty((4, view_size, view_size), dtype=np.int64)
+    dy = np.empty((4, view_size, view_size), dtype=np.int64)
+    for d in range(4):
+        fx, fy = DIR_TO_VEC[d]
+        rx, ry = DIR_TO_VEC[(d + 1) % 4]
+        dx[d] = fwd * fx + right * rx
+        dy[d] = fwd * fy + right * ry
+
+    return dx, dy
+
+def batch_vis_mask(see_behind):
+    """
+    Compute the visibility masks of a batch of agent views, given a
+    (N, width, height) boolean array telling which cells the agent can see
+    behind. This is the batched version of vis_mask_rows, with the agent
+    at the bottom center of each view.
+    """
+
+    n, width, height = see_behind.shape
+    assert width < 63
+
+    # Pack each row of each view into an integer bitmask
+    shifts = np.arange(width, dtype=np.int64)
+    rows = (see_behind.astype(np.int64) << shifts[None, :, None]).sum(axis=1).T
+
+    full = (1 << width) - 1
+    has_right = full >> 1
+    has_left = full & ~1
+
+    ax, ay = width // 2, height - 1
+    mask_rows = np.zeros((height, n), dtype=np.int64)
+    mask_rows[ay] = 1 << ax
+
+    for j in reversed(range(0, ay + 1)):
+        seen = mask_rows[j]
+        if not seen.any():
+            break
+        pro = rows[j]
+
+        # Left to right pass
+        seen = seen | ((_fill_right(seen & pro, pro.copy(), width) << 1) & full)
+        src = seen & pro & has_right
+        up = src | (src << 1)
+
+        # Right to left pass
+        seen = seen | (_fill_left(seen & pro, pro.copy(), width) >> 1)
+        src = seen & pro & has_left
+        up |= src | (src >> 1)
+
+        mask_rows[j] = seen
+        if j > 0:
+            mask_rows[j-1] |= up
+
+    # Unpack the bitmasks into a (N, width, height) boolean array
+    return ((mask_rows.T[:, None, :] >> shifts[None, :, None]) & 1).astype(bool)
+
+class VecMiniGrid:
+    """
+    Batch of environments of the same kind stepped together, with their
+    state held as stacked arrays: grid planes (N, width, height, 3), agent
+    positions and directions, and encodings of the carried objects.
+
+    Levels are generated by one regular environment per slot, seeded with
+    seed + slot index, so that the levels of each slot are the same as
+    those of a regular environment with the same seed. Stepping applies the
+    semantics of MiniGridEnv.step to all slots in one vectorized pass, and
+    slots whose episode is done are reset automatically.
+
+    Only environments whose objects are fully described by the grid
+    planes and whose dynamics are those of MiniGridEnv.step are supported,
+    see supported_envs. Boxes are taken to be empty.
+    """
+
+    # Environment classes that can be simulated
+    supported_envs = (EmptyEnv, DoorKeyEnv, FourRoomsEnv, CrossingEnv)
+
+    def __init__(self, env_id, num_envs, seed=0, prefetch=0):
+        """
+        env_id is a registered environment id, or a function creating an
+        environment. When prefetch is positive, levels are generated in the
+        background with up to prefetch levels ready per slot, see
+        start_prefetch.
+        """
+
+        assert num_envs > 0
+
+        make_env = env_id if callable(env_id) else lambda: gym.make(env_id)
+        self.envs = [make_env().unwrapped for i in range(0, num_envs)]
+
+        env = self.envs[0]
+        assert isinstance(env, self.supported_envs), \
+            "unsupported environment %s" % type(env).__name__
+
+        self.num_envs = num_envs
+        self.width = env.width
+        self.height = env.height
+        self.max_steps = env.max_steps
+        self.agent_view_size = env.agent_view_size
+        self.see_through_walls = env.see_through_walls
+
+        self.actions = MiniGridEnv.Actions
+        self.single_observation_space = env.observation_space
+        self.single_action_space = env.action_space
+        self.reward_range = env.reward_range
+
+        # Grid planes of all slots, surrounded by a border of walls at
+        # least as wide as the agent view, so that views can be gathered
+        # without bounds checks
+        pad = self.agent_view_size
+        self.pad = pad
+        self.padded = np.empty(
+            (num_envs, self.width + 2 * pad, self.height + 2 * pad, 3),
+            dtype='uint8'
+        )
+        self.padded[:, :, :] = WALL_CELL
+        self.grids = self.padded[:, pad:pad+self.width, pad:pad+self.height]
+
+        self.agent_pos = np.zeros((num_envs, 2), dtype=np.int64)
+        self.agent_dir = np.zeros(num_envs, dtype=np.int64)
+        self.carrying = np.zeros((num_envs, 3), dtype='uint8')
+        self.carrying[:] = EMPTY_CELL
+        self.step_count = np.zeros(num_envs, dtype=np.int64)
+        self.missions = [''] * num_envs
+
+        self.view_dx, self.view_dy = view_offsets(self.agent_view_size)
+        self._slots = np.arange(num_envs)
+        self._actions = None
+
+        self.prefetch = prefetch
+        self.prefetcher = None
+
+        self.seed(seed)
+
+    def seed(self, seed=0):
+        """
+        Seed the level generator of each slot with seed + slot index
+        """
+
+        for i, env in enumerate(self.envs):
+            env.seed(seed + i)
+        if self.prefetch > 0:
+            self.prefetcher = start_prefetch(self.envs, seed, self.prefetch, self.prefetcher)
+        return [seed + i for i in range(0, self.num_envs)]
+
+    def _reset_slots(self, slots):
+        """
+        Generate new levels for the given slots
+        """
+
+        for i in slots:
+            env = self.envs[i]
+            env.reset()
+
+            self.grids[i] = env.grid.array
+            self.agent_pos[i] = env.agent_pos
+            self.agent_dir[i] = env.agent_dir
+            self.carrying[i] = EMPTY_CELL
+            self.step_count[i] = 0
+            self.missions[i] = env.mission
+
+    def gen_images(self, slots=None):
+        """
+        Generate the agent views of the given slots, or of all slots
+        """
+
+        if slots is None:
+            slots = self._slots
+        sz = self.agent_view_size
+
+        # Gather the views from the padded planes with a single take on
+        # flat cell indices, which is much faster than fancy indexing
+        _, pw, ph, _ = self.padded.shape
+        dirs = self.agent_dir[slots]
+        xs = self.agent_pos[slots, 0, None, None] + self.view_dx[dirs] + self.pad
+        ys = self.agent_pos[slots, 1, None, None] + self.view_dy[dirs] + self.pad
+        cells = (slots[:, None, None] * pw + xs) * ph + ys
+        images = self.padded.reshape(-1, 3).take(cells, axis=0)
+
+        if not self.see_through_walls:
+            types = images[..., 0]
+            see_behind = (types != WALL) & ((types != DOOR) | (images[..., 2] == 0))
+            images *= batch_vis_mask(see_behind)[..., None]
+
+        # Make it so the agent sees what it's carrying
+        images[:, sz // 2, sz - 1] = self.carrying[slots]
+
+        return images
+
+    def _gen_obs(self):
+        return {
+            'image': self.gen_images(),
+            'direction': self.agent_dir.copy(),
+            'mission': list(self.missions)
+        }
+
+    def reset(self):
+        self._reset_slots(self._slots)
+        return self._gen_obs()
+
+    def step_async(self, actions):
+        self._actions = np.asarray(actions)
+
+    def _apply_actions(self, actions, active=None):
+        """
+        Apply one action per slot, without resetting finished slots or
+        generating observations. Slots where active is False are left
+        untouched. Returns the rewards and done flags.
+        """
+
+        slots = self._slots
+        grids = self.grids
+        carrying = self.carrying
+
+        if active is None:
+            self.step_count += 1
+        else:
+            # Inactive slots get an action matching none of the cases
+            actions = np.where(active, np.asarray(actions, dtype=np.int64), -1)
+            self.step_count[active] += 1
+
+        rewards = np.zeros(self.num_envs, dtype=np.float64)
+        dones = np.zeros(self.num_envs, dtype=bool)
+
+        # Position and contents of the cells in front of the agents
+        fwd_pos = self.agent_pos + DIR_VECS[self.agent_dir]
+        fx, fy = fwd_pos[:, 0], fwd_pos[:, 1]
+        cells = grids[slots, fx, fy]
+        types = cells[:, 0]
+        carried = carrying[:, 0] != EMPTY
+
+        # Rotate left and right
+        left = actions == self.actions.left
+        self.agent_dir[left] = (self.agent_dir[left] - 1) % 4
+        right = actions == self.actions.right
+        self.agent_dir[right] = (self.agent_dir[right] + 1) % 4
+
+        # Move forward
+        forward = actions == self.actions.forward
+        can_overlap = CAN_OVERLAP[types] | ((types == DOOR) & (cells[:, 2] == 0))
+        move = forward & can_overlap
+        self.agent_pos[move] = fwd_pos[move]
+        goal = forward & (types == GOAL)
+        dones |= goal | (forward & (types == LAVA))
+
+        # Pick up an object
+        pickup = (actions == self.actions.pickup) & CAN_PICKUP[types] & ~carried
+        carrying[pickup] = cells[pickup]
+        grids[slots[pickup], fx[pickup], fy[pickup]] = EMPTY_CELL
+
+        # Drop an object
+        drop = (actions == self.actions.drop) & (types == EMPTY) & carried
+        grids[slots[drop], fx[drop], fy[drop]] = carrying[drop]
+        carrying[drop] = EMPTY_CELL
+
+        # Toggle doors, unlocking them with a key of the same color, and
+        # replace boxes by their (empty) contents
+        toggle = actions == self.actions.toggle
+        door = toggle & (types == DOOR)
+        state = cells[:, 2]
+        has_key = (carrying[:, 0] == KEY) & (carrying[:, 1] == cells[:, 1])
+        unlock = door & (state == 2) & has_key
+        flip = door & (state != 2)
+        new_state = np.where(unlock, 0, 1 - state)
+        change = unlock | flip
+        grids[slots[change], fx[change], fy[change], 2] = new_state[change]
+        box = toggle & (types == BOX)
+        grids[slots[box], fx[box], fy[box]] = EMPTY_CELL
+
+        rewards[goal] = 1 - 0.9 * (self.step_count[goal] / self.max_steps)
+        dones |= self.step_count >= self.max_steps
+        if active is not None:
+            dones &= active
+
+        return rewards, dones
+
+    def _reset_done(self, dones):
+        """
+        Reset the finished slots, returning infos holding their final views
+        """
+
+        infos = [{} for i in range(0, self.num_envs)]
+        done_slots = np.flatnonzero(dones)
+        if len(done_slots) > 0:
+            images = self.gen_images(done_slots)
+            for k, i in enumerate(done_slots):
+                infos[i]['terminal_image'] = images[k]
+            self._reset_slots(done_slots)
+        return infos
+
+    def step_wait(self):
+        actions = self._actions
+        self._actions = None
+        assert actions.shape == (self.num_envs,)
+
+        rewards, dones = self._apply_actions(actions)
+        infos = self._reset_done(dones)
+
+        return self._gen_obs(), rewards, dones, infos
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def step_many(self, actions):
+        """
+        Apply a sequence of actions of shape (num_steps, num_envs), see
+        MiniGridEnv.step_many. Each slot stops at the end of its episode and
+        is then reset, and observations are only generated once, at the
+        end. Returns the final observations, rewards and done flags of shape
+        (num_steps, num_envs), which are zero after a slot is done, and infos
+        holding the final view of the finished slots.
+        """
+
+        actions = np.asarray(actions)
+        assert actions.ndim == 2 and actions.shape[1] == self.num_envs
+
+        num_steps = actions.shape[0]
+        rewards = np.zeros((num_steps, self.num_envs), dtype=np.float64)
+        dones = np.zeros((num_steps, self.num_envs), dtype=bool)
+        active = np.ones(self.num_envs, dtype=bool)
+
+        for t in range(0, num_steps):
+            rewards[t], dones[t] = self._apply_actions(actions[t], active)
+            active &= ~dones[t]
+            if not active.any():
+                break
+
+        infos = self._reset_done(~active)
+
+        return self._gen_obs(), rewards, dones, infos
+
+    async def areset(self):
+        return await run_async(self.reset)
+
+    async def astep(self, actions):
+        """
+        Coroutine version of step. The batch is stepped on a worker thread,
+        most of it outside of the global interpreter lock.
+        """
+
+        return await run_async(self.step, actions)
+
+    def close(self):
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        for env in self.envs:
+            env.close()
+
+def start_prefetch(envs, seed, queue_size, prefetcher=None):
+    """
+    Start prefetching the levels of a list of environments seeded with
+    seed + index, replacing a previous prefetcher. The first episode of
+    each environment is generated as usual, and the following episodes of
+    environment i use the seeds seed + i + k * len(envs), k = 1, 2, ...
+    """
+
+    if prefetcher is not None:
+        prefetcher.close()
+
+    # The levels of all environments are generated by the same process
+    config = envs[0].unwrapped.gen_config()
+    assert all(env.unwrapped.gen_config() == config for env in envs)
+
+    num_envs = len(envs)
+    seeds = [
+        range(seed + i + num_envs, 2 ** 63, num_envs)
+        for i in range(0, num_envs)
+    ]
+    prefetcher = LevelPrefetcher(envs[0], seeds, queue_size=queue_size)
+
+    for i, env in enumerate(envs):
+        env.unwrapped.prefetcher = prefetcher
+        env.unwrapped.prefetch_slot = i
+
+    return prefetcher
+
+async def wait_readable(files):
+    """
+    Wait until each of the given file objects (sockets or pipe
+    connections) has data to read, without blocking the event loop.
+    Requires Python 3.7 or later.
+    """
+
+    loop = asyncio.get_running_loop()
+    waiters = []
+
+    for f in files:
+        fd = f.fileno()
+        waiter = loop.create_future()
+
+        def ready(fd=fd, waiter=waiter):
+            loop.remove_reader(fd)
+            if not waiter.done():
+                waiter.set_result(None)
+
+        loop.add_reader(fd, ready)
+        waiters.append(waiter)
+
+    try:
+        await asyncio.gather(*waiters)
+    finally:
+        for f in files:
+            loop.remove_reader(f.fileno())
+
+def _make_env(env_id):
+    """
+    Create an environment from a registered id or a creation function
+    """
+
+    return env_id() if callable(env_id) else gym.make(env_id)
+
+def _shared_arrays(buf, num_envs, image_shape):
+    """
+    Lay out the arrays exchanged with worker processes over a shared
+    memory buffer. Returns the arrays and the total size in bytes.
+    """
+
+    fields = [
+        ('image', (num_envs,) + image_shape, 'uint8'),
+        ('terminal_image', (num_envs,) + image_shape, 'uint8'),
+        ('direction', (num_envs,), 'int64'),
+        ('reward', (num_envs,), 'float64'),
+        ('done', (num_envs,), 'bool'),
+        ('action', (num_envs,), 'int64'),
+    ]
+
+    arrays = {}
+    offset = 0
+    for name, shape, dtype in fields:
+        # Keep every array 8-byte aligned
+        offset = (offset + 7) // 8 * 8
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if buf is not None:
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)
+        offset += size
+
+    return arrays, offset
+
+def _subproc_worker(remote, parent_remote, env_id, slots, shm_name, num_envs, image_shape, seed):
+    """
+    Worker process of SubprocVecEnv, stepping the environments of the
+    given slots on command
+    """
+
+    from multiprocessing import shared_memory
+
+    parent_remote.close()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    arrays, _ = _shared_arrays(shm.buf, num_envs, image_shape)
+
+    envs = []
+    for i in slots:
+        env = _make_env(env_id)
+        env.seed(seed + i)
+        envs.append(env)
+    missions = [None] * len(slots)
+
+    def write_obs(k, i, obs):
+        arrays['image'][i] = obs['image']
+        arrays['direction'][i] = obs['direction']
+        # Only send missions when they change
+        if obs['mission'] != missions[k]:
+            missions[k] = obs['mission']
+            changed[i] = obs['mission']
+
+    try:
+        while True:
+            cmd = remote.recv()
+            changed = {}
+            infos = {}
+
+            if cmd == 'step':
+                for k, i in enumerate(slots):
+                    obs, reward, done, info = envs[k].step(int(arrays['action'][i]))
+                    if done:
+                        arrays['terminal_image'][i] = obs['image']
+                        obs = envs[k].reset()
+                    write_obs(k, i, obs)
+                    arrays['reward'][i] = reward
+                    arrays['done'][i] = done
+                    if info:
+                        infos[i] = info
+                remote.send((changed, infos))
+
+            elif cmd == 'reset':
+                for k, i in enumerate(slots):
+                    write_obs(k, i, envs[k].reset())
+                remote.send((changed, infos))
+
+            elif cmd == 'close':
+                break
+
+            else:
+                assert False, "unknown command '%s'" % cmd
+    finally:
+        del arrays
+        shm.close()
+        for env in envs:
+            env.close()
+
+class SubprocVecEnv:
+    """
+    Vector environment stepping regular environments in worker processes,
+    for environments that VecMiniGrid can't simulate. Each worker steps
+    several environments, and writes their observations, rewards and done
+    flags straight into a shared memory block, so that only short commands
+    go through the pipes. Environments of slot i are seeded with seed + i
+    and reset automatically when done.
+
+    Requires Python 3.8 or later (multiprocessing.shared_memory).
+    """
+
+    def __init__(self, env_id, num_envs, num_workers=None, seed=0, context=None):
+        """
+        env_id is a registered environment id, or a function creating an
+        environment, which must be picklable unless processes are forked
+        """
+
+        import multiprocessing as mp
+        from multiprocessing import shared_memory
+
+        assert num_envs > 0
+        if num_workers is None:
+            num_workers = mp.cpu_count()
+        num_workers = max(1, min(num_workers, num_envs))
+
+        env = _make_env(env_id)
+        self.single_observation_space = env.observation_space
+        self.single_action_space = env.action_space
+        self.reward_range = env.reward_range
+        image_shape = env.observation_space.spaces['image'].shape
+        env.close()
+
+        self.num_envs = num_envs
+        self.missions = [''] * num_envs
+
+        _, size = _shared_arrays(None, num_envs, image_shape)
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.arrays, _ = _shared_arrays(self.shm.buf, num_envs, image_shape)
+
+        ctx = mp.get_context(context)
+        self.remotes = []
+        self.processes = []
+        for slots in np.array_split(np.arange(num_envs), num_workers):
+            remote, worker_remote = ctx.Pipe()
+            process = ctx.Process(
+                target=_subproc_worker,
+                args=(
+                    worker_remote,
+                    remote,
+                    env_id,
+                    slots.tolist(),
+                    self.shm.name,
+                    num_envs,
+                    image_shape,
+                    seed
+                ),
+                daemon=True
+            )
+            process.start()
+            worker_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(process)
+
+        self.waiting = False
+        self.closed = False
+
+    def _recv_all(self):
+        infos = [{} for i in range(0, self.num_envs)]
+        for remote in self.remotes:
+            changed, worker_infos = remote.recv()
+            for i, mission in changed.items():
+                self.missions[i] = mission
+            for i, info in worker_infos.items():
+                infos[i] = info
+        self.waiting = False
+        return infos
+
+    def _obs(self):
+        return {
+            'image': self.arrays['image'].copy(),
+            'direction': self.arrays['direction'].copy(),
+            'mission': list(self.missions)
+        }
+
+    def reset(self):
+        assert not self.waiting
+        for remote in self.remotes:
+            remote.send('reset')
+        self._recv_all()
+        return self._obs()
+
+    def step_async(self, actions):
+        assert not self.waiting
+        self.arrays['action'][:] = actions
+        for remote in self.remotes:
+            remote.send('step')
+        self.waiting = True
+
+    def step_wait(self):
+        infos = self._recv_all()
+
+        dones = self.arrays['done'].copy()
+        for i in np.flatnonzero(dones):
+            infos[i]['terminal_image'] = self.arrays['terminal_image'][i].copy()
+
+        return self._obs(), self.arrays['reward'].copy(), dones, infos
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    async def areset(self):
+        assert not self.waiting
+        for remote in self.remotes:
+            remote.send('reset')
+        self.waiting = True
+        await wait_readable(self.remotes)
+        self._recv_all()
+        return self._obs()
+
+    async def astep(self, actions):
+        """
+        Coroutine version of step. The commands are sent to the workers,
+        then the event loop runs until all of them have replied.
+        """
+
+        self.step_async(actions)
+        await wait_readable(self.remotes)
+        return self.step_wait()
+
+    def close(self):
+        if self.closed:
+            return
+        if self.waiting:
+            self._recv_all()
+        for remote in self.remotes:
+            remote.send('close')
+        for process in self.processes:
+            process.join()
+        for remote in self.remotes:
+            remote.close()
+
+        # The arrays must be released before the shared memory is
+        self.arrays = None
+        self.shm.close()
+        self.shm.unlink()
+        self.closed = True
+
+    def __del__(self):
+        if not getattr(self, 'closed', True):
+            self.close()
+
+class ThreadVecEnv:
+    """
+    Vector environment stepping regular environments from a pool of
+    threads, without any inter-process communication. Each task steps a
+    chunk of environments and writes their observations, rewards and done
+    flags into preallocated arrays. Environments of slot i are seeded with
+    seed + i and reset automatically when done.
+
+    Environments of different slots only share the caches set on their
+    class (vis_cache, level_cache), which are thread-safe, so the chunks
+    can run concurrently. With the standard interpreter, only the NumPy parts
+    of a step (view extraction, visibility, encoding, rendering) run
+    outside of the global interpreter lock; on free-threaded builds of
+    Python the whole step scales with the number of threads.
+    """
+
+    def __init__(self, env_id, num_envs, num_workers=None, seed=0, prefetch=0):
+        """
+        env_id is a registered environment id, or a function creating an
+        environment. When prefetch is positive, levels are generated in the
+        background, see VecMiniGrid.
+        """
+
+        import os
+        from concurrent.futures import ThreadPoolExecutor
+
+        assert num_envs > 0
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        num_workers = max(1, min(num_workers, num_envs))
+
+        self.envs = []
+        for i in range(0, num_envs):
+            env = _make_env(env_id)
+            env.seed(seed + i)
+            self.envs.append(env)
+
+        env = self.envs[0]
+        self.single_observation_space = env.observation_space
+        self.single_action_space = env.action_space
+        self.reward_range = env.reward_range
+        image_shape = env.observation_space.spaces['image'].shape
+
+        self.num_envs = num_envs
+        self.images = np.zeros((num_envs,) + image_shape, dtype='uint8')
+        self.terminal_images = np.zeros((num_envs,) + image_shape, dtype='uint8')
+        self.directions = np.zeros(num_envs, dtype='int64')
+        self.rewards = np.zeros(num_envs, dtype='float64')
+        self.dones = np.zeros(num_envs, dtype=bool)
+        self.missions = [''] * num_envs
+        self.infos = [{} for i in range(0, num_envs)]
+
+        self.chunks = [
+            chunk.tolist()
+            for chunk in np.array_split(np.arange(num_envs), num_workers)
+        ]
+        self.pool = ThreadPoolExecutor(max_workers=num_workers)
+        self.futures = None
+
+        self.prefetcher = None
+        if prefetch > 0:
+            self.prefetcher = start_prefetch(self.envs, seed, prefetch)
+
+    def _write_obs(self, i, obs):
+        self.images[i] = obs['image']
+        self.directions[i] = obs['direction']
+        self.missions[i] = obs['mission']
+
+    def _reset_chunk(self, slots):
+        for i in slots:
+            self._write_obs(i, self.envs[i].reset())
+
+    def _step_chunk(self, slots, actions):
+        for i in slots:
+            env = self.envs[i]
+            obs, reward, done, info = env.step(int(actions[i]))
+            if done:
+                self.terminal_images[i] = obs['image']
+                info = dict(info, terminal_image=self.terminal_images[i].copy())
+                obs = env.reset()
+            self._write_obs(i, obs)
+            self.rewards[i] = reward
+            self.dones[i] = done
+            self.infos[i] = info
+
+    def _wait(self):
+        futures = self.futures
+        self.futures = None
+        for future in futures:
+            future.result()
+
+    def _obs(self):
+        return {
+            'image': self.images.copy(),
+            'direction': self.directions.copy(),
+            'mission': list(self.missions)
+        }
+
+    def reset(self):
+        assert self.futures is None
+        self.futures = [
+            self.pool.submit(self._reset_chunk, slots) for slots in self.chunks
+        ]
+        self._wait()
+        return self._obs()
+
+    def step_async(self, actions):
+        assert self.futures is None
+        actions = np.array(actions)
+        self.futures = [
+            self.pool.submit(self._step_chunk, slots, actions)
+            for slots in self.chunks
+        ]
+
+    def step_wait(self):
+        self._wait()
+        infos = self.infos
+        self.infos = [{} for i in range(0, self.num_envs)]
+        return self._obs(), self.rewards.copy(), self.dones.copy(), infos
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def _step_many_chunk(self, slots, actions, rewards, dones):
+        for i in slots:
+            env = self.envs[i]
+            obs, env_rewards, env_dones, info = env.step_many(actions[:, i])
+            if len(env_dones) > 0 and env_dones[-1]:
+                self.terminal_images[i] = obs['image']
+                info = dict(info, terminal_image=self.terminal_images[i].copy())
+                obs = env.reset()
+            self._write_obs(i, obs)
+            rewards[:len(env_rewards), i] = env_rewards
+            dones[:len(env_dones), i] = env_dones
+            self.infos[i] = info
+
+    def step_many(self, actions):
+        """
+        Apply a sequence of actions of shape (num_steps, num_envs) with
+        the step_many method of each environment, see VecMiniGrid.step_many
+        """
+
+        assert self.futures is None
+        actions = np.array(actions)
+        assert actions.ndim == 2 and actions.shape[1] == self.num_envs
+
+        rewards = np.zeros(actions.shape, dtype=np.float64)
+        dones = np.zeros(actions.shape, dtype=bool)
+        self.futures = [
+            self.pool.submit(self._step_many_chunk, slots, actions, rewards, dones)
+            for slots in self.chunks
+        ]
+        self._wait()
+
+        infos = self.infos
+        self.infos = [{} for i in range(0, self.num_envs)]
+        return self._obs(), rewards, dones, infos
+
+    async def _await_chunks(self):
+        await asyncio.gather(*[asyncio.wrap_future(f) for f in self.futures])
+
+    async def areset(self):
+        assert self.futures is None
+        self.futures = [
+            self.pool.submit(self._reset_chunk, slots) for slots in self.chunks
+        ]
+        await self._await_chunks()
+        self._wait()
+        return self._obs()
+
+    async def astep(self, actions):
+        """
+        Coroutine version of step. The chunks run on the pool of the
+        environment, and the event loop runs until all of them are done.
+        """
+
+        self.step_async(actions)
+        await self._await_chunks()
+        return self.step_wait()
+
+    def close(self):
+        if self.futures is not None:
+            self._wait()
+        self.pool.shutdown()
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        for env in self.envs:
+            env.close()
+
+def make_vec_env(env_id, num_envs, seed=0, num_workers=1):
+    """
+    Create the fastest vector environment available for an environment:
+    VecMiniGrid if it supports it, ThreadVecEnv otherwise
+    """
+
+    env = _make_env(env_id)
+    supported = isinstance(env.unwrapped, VecMiniGrid.supported_envs)
+    env.close()
+
+    if supported:
+        return VecMiniGrid(env_id, num_envs, seed=seed)
+    return ThreadVecEnv(env_id, num_envs, num_workers=num_workers, seed=seed)
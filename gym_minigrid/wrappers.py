@@ -6,20 +6,29 @@ import numpy as np
 import gym
 from gym import error, spaces, utils
 from .minigrid import OBJECT_TO_IDX, COLOR_TO_IDX
-from .minigrid import CELL_PIXELS
+from .minigrid import CELL_PIXELS, LevelCache
 
 class ReseedWrapper(gym.core.Wrapper):
     """
     Wrapper to always regenerate an environment with the same set of seeds.
     This can be used to force an environment to always keep the same
     configuration when reset.
+
+    By default, the generated levels are kept in a LevelCache holding all
+    the seeds, so that they are only generated once. A LevelCache can also
+    be passed to share it, or None to disable caching.
     """
 
-    def __init__(self, env, seeds=[0], seed_idx=0):
+    def __init__(self, env, seeds=[0], seed_idx=0, level_cache=True):
         self.seeds = list(seeds)
         self.seed_idx = seed_idx
         super().__init__(env)
 
+        if level_cache is True:
+            level_cache = LevelCache(max_size=max(len(set(self.seeds)), 1))
+        if level_cache is not None:
+            self.env.unwrapped.level_cache = level_cache
+
     def reset(self, **kwargs):
         seed = self.seeds[self.seed_idx]
         self.seed_idx = (self.seed_idx + 1) % len(self.seeds)
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import sys
 import random
 import numpy as np
 import gym
@@ -14,6 +15,710 @@ from gym_minigrid.wrappers import *
 
 ##############################################################################
 
+print('testing agent_sees method')
+env = gym.make('MiniGrid-DoorKey-6x6-v0')
+goal_pos = (env.grid.width - 2, env.grid.height - 2)
+
+# Test the "in" operator on grid objects
+assert ('green', 'goal') in env.grid
+assert ('blue', 'key') not in env.grid
+
+# Test the env.agent_sees() function
+env.reset()
+for i in range(0, 500):
+    action = random.randint(0, env.action_space.n - 1)
+    obs, reward, done, info = env.step(action)
+    goal_visible = ('green', 'goal') in Grid.decode(obs['image'])
+    agent_sees_goal = env.agent_sees(*goal_pos)
+    assert agent_sees_goal == goal_visible
+    if done:
+        env.reset()
+
+#############################################################################
+
+print('testing visibility mask cache')
+from gym_minigrid.minigrid import VisMaskCache
+env1 = gym.make('MiniGrid-MultiRoom-N6-v0')
+env2 = gym.make('MiniGrid-MultiRoom-N6-v0')
+env2.unwrapped.vis_cache = VisMaskCache(max_size=64)
+env1.seed(0)
+env2.seed(0)
+env1.reset()
+env2.reset()
+for i in range(0, 500):
+    action = random.randint(0, 2)
+    obs1, _, done, _ = env1.step(action)
+    obs2, _, _, _ = env2.step(action)
+    assert np.array_equal(obs1['image'], obs2['image'])
+    if done:
+        env1.reset()
+        env2.reset()
+cache = env2.unwrapped.vis_cache
+assert cache.hits > 0 and cache.misses > 0
+assert len(cache) <= 64
+
+print('testing grid change journal')
+from gym_minigrid.minigrid import Ball, Key
+grid = Grid(5, 5)
+version = grid.version
+grid.set(1, 2, Ball('red'))
+grid.set(3, 3, Key('blue'))
+grid.set(1, 2, None)
+assert grid.changes_since(version) == {(1, 2), (3, 3)}
+assert grid.changes_since(grid.version) == set()
+grid.touch_all()
+assert grid.changes_since(version) is None
+
+print('testing grid object index')
+grid = Grid(6, 6)
+grid.wall_rect(0, 0, 6, 6)
+grid.set(2, 3, Key('blue'))
+assert grid.count('wall') == 20
+assert grid.count('key') == 1 and grid.count('key', 'red') == 0
+grid.set(1, 1, Key('red'))
+grid.set(2, 3, None)
+assert grid.positions('key') == [(1, 1)]
+assert ('red', 'key') in grid and ('blue', 'key') not in grid
+assert grid.count('dirt') == 0
+assert ('pink', 'key') not in grid and grid.count('key', 'pink') == 0
+assert grid.positions('key', 'pink') == []
+
+print('testing grid sync')
+env = gym.make('MiniGrid-Empty-5x5-v0').unwrapped
+env.reset()
+class ColorSwitch(Ball):
+    def toggle(self, env, pos):
+        # Changes state without writing it back to the grid
+        self.color = 'red' if self.color == 'blue' else 'blue'
+        return True
+fwd_pos = tuple(env.front_pos)
+env.grid.set(*fwd_pos, ColorSwitch('blue'))
+version = env.grid.version
+env.step(env.actions.toggle)
+assert env.grid.version != version
+assert ('red', 'ball') in env.grid and ('blue', 'ball') not in env.grid
+version = env.grid.version
+env.grid.sync(*fwd_pos, env.grid.get(*fwd_pos))
+assert env.grid.version == version
+
+print('testing state hash')
+env = gym.make('MiniGrid-DoorKey-8x8-v0')
+env.seed(3)
+env.reset()
+hashes = [env.unwrapped.state_hash()]
+for i in range(0, 200):
+    obs, _, done, _ = env.step(random.randint(0, 5))
+    grid_hash = env.unwrapped.grid.hash()
+    env.unwrapped.grid.touch_all()
+    assert env.unwrapped.grid.hash() == grid_hash
+    hashes.append(env.unwrapped.state_hash())
+    if done:
+        break
+env.seed(3)
+env.reset()
+assert env.unwrapped.state_hash() == hashes[0]
+env.step(env.actions.left)
+assert env.unwrapped.state_hash() != hashes[0]
+
+print('testing clone_state and restore_state')
+for env_name in ['MiniGrid-DoorKey-8x8-v0', 'MiniGrid-Dynamic-Obstacles-8x8-v0', 'MiniGrid-PutNear-6x6-N2-v0']:
+    env = gym.make(env_name)
+    env.reset()
+    state = env.unwrapped.clone_state()
+    actions = [random.randint(0, 2) for i in range(0, 50)]
+    def rollout():
+        results = []
+        for action in actions:
+            obs, reward, done, _ = env.step(action)
+            results.append((obs['image'].tobytes(), reward, done, env.unwrapped.state_hash()))
+            if done:
+                break
+        return results
+    results = rollout()
+    env.unwrapped.restore_state(state)
+    assert rollout() == results
+    env.reset()
+    env.unwrapped.restore_state(state)
+    assert rollout() == results
+
+print('testing flyweight objects')
+from gym_minigrid.minigrid import Wall, Goal
+import io
+import pickle
+assert Wall() is Wall('grey') and Wall('red') is not Wall()
+assert pickle.loads(pickle.dumps(Wall('red'))) is Wall('red')
+grid = Grid(5, 5)
+grid.set(2, 2, Key('red'))
+grid.horz_wall(0, 2)
+assert grid.get(2, 2) is Wall() and grid.count('key') == 0
+goal = Goal()
+goal.cur_pos = (1, 1)
+assert goal.cur_pos is None
+
+print('testing vectorized environments')
+from gym_minigrid.vector import VecMiniGrid
+for env_name in ['MiniGrid-DoorKey-5x5-v0', 'MiniGrid-LavaCrossingS9N1-v0']:
+    num_envs = 4
+    vec_env = VecMiniGrid(env_name, num_envs, seed=10)
+    envs = [gym.make(env_name) for i in range(0, num_envs)]
+    for i, env in enumerate(envs):
+        env.seed(10 + i)
+        env.reset()
+    vec_env.reset()
+    for step in range(0, 500):
+        actions = [random.randint(0, 5) for i in range(0, num_envs)]
+        vec_obs, vec_rewards, vec_dones, _ = vec_env.step(actions)
+        for i, env in enumerate(envs):
+            obs, reward, done, _ = env.step(actions[i])
+            if done:
+                obs = env.reset()
+            assert done == vec_dones[i] and reward == vec_rewards[i]
+            assert np.array_equal(obs['image'], vec_obs['image'][i])
+
+# Shared memory needs Python 3.8 or later
+if sys.version_info >= (3, 8):
+    print('testing subprocess vector environment')
+    from gym_minigrid.vector import SubprocVecEnv
+    env_name = 'MiniGrid-Dynamic-Obstacles-6x6-v0'
+    num_envs = 4
+    vec_env = SubprocVecEnv(env_name, num_envs, num_workers=2, seed=3, context='fork')
+    envs = [gym.make(env_name) for i in range(0, num_envs)]
+    for i, env in enumerate(envs):
+        env.seed(3 + i)
+        env.reset()
+    vec_env.reset()
+    for step in range(0, 200):
+        actions = [random.randint(0, 2) for i in range(0, num_envs)]
+        vec_obs, vec_rewards, vec_dones, vec_infos = vec_env.step(actions)
+        for i, env in enumerate(envs):
+            obs, reward, done, _ = env.step(actions[i])
+            assert done == vec_dones[i] and reward == vec_rewards[i]
+            if done:
+                assert np.array_equal(obs['image'], vec_infos[i]['terminal_image'])
+                obs = env.reset()
+            assert np.array_equal(obs['image'], vec_obs['image'][i])
+    vec_env.close()
+
+print('testing thread vector environment')
+from gym_minigrid.vector import ThreadVecEnv
+env_name = 'MiniGrid-PutNear-6x6-N2-v0'
+num_envs = 6
+vec_env = ThreadVecEnv(env_name, num_envs, num_workers=3, seed=5)
+envs = [gym.make(env_name) for i in range(0, num_envs)]
+for i, env in enumerate(envs):
+    env.seed(5 + i)
+    env.reset()
+vec_env.reset()
+for step in range(0, 200):
+    actions = [random.randint(0, 5) for i in range(0, num_envs)]
+    vec_obs, vec_rewards, vec_dones, vec_infos = vec_env.step(actions)
+    for i, env in enumerate(envs):
+        obs, reward, done, _ = env.step(actions[i])
+        assert done == vec_dones[i] and reward == vec_rewards[i]
+        if done:
+            assert np.array_equal(obs['image'], vec_infos[i]['terminal_image'])
+            obs = env.reset()
+        assert np.array_equal(obs['image'], vec_obs['image'][i])
+        assert obs['mission'] == vec_obs['mission'][i]
+vec_env.close()
+# Caches shared between threads
+from concurrent.futures import ThreadPoolExecutor
+from gym_minigrid.minigrid import LevelCache
+cache = LevelCache(max_size=4)
+def use_cache(k):
+    for i in range(0, 2000):
+        key = (k + i) % 8
+        if cache.get(key) is None:
+            cache.put(key, b'')
+with ThreadPoolExecutor(4) as pool:
+    list(pool.map(use_cache, range(0, 4)))
+assert len(cache) == 4 and cache.hits + cache.misses == 8000
+
+print('testing env server')
+import threading
+from gym_minigrid.server import EnvServer, EnvClient
+from gym_minigrid.vector import make_vec_env
+env_name = 'MiniGrid-Fetch-5x5-N2-v0'
+num_envs = 4
+server = EnvServer(env_name, num_envs, ('127.0.0.1', 0), seed=7)
+thread = threading.Thread(target=server.serve_one)
+thread.start()
+client = EnvClient(server.address)
+vec_env = make_vec_env(env_name, num_envs, seed=7)
+obs = client.reset()
+vec_obs = vec_env.reset()
+assert np.array_equal(obs['image'], vec_obs['image'])
+assert obs['mission'] == vec_obs['mission']
+for step in range(0, 200):
+    actions = [random.randint(0, 5) for i in range(0, num_envs)]
+    obs, rewards, dones, infos = client.step(actions)
+    vec_obs, vec_rewards, vec_dones, vec_infos = vec_env.step(actions)
+    assert np.array_equal(dones, vec_dones) and np.array_equal(rewards, vec_rewards)
+    assert np.array_equal(obs['image'], vec_obs['image'])
+    assert obs['mission'] == vec_obs['mission']
+    for i in np.flatnonzero(dones):
+        assert np.array_equal(infos[i]['terminal_image'], vec_infos[i]['terminal_image'])
+# Invalid actions are reported to the client, which stays connected
+try:
+    client.step([200] * num_envs)
+    assert False, 'invalid action was accepted'
+except RuntimeError:
+    pass
+obs = client.reset()
+assert obs['image'].shape[0] == num_envs
+client.close()
+thread.join()
+server.close()
+vec_env.close()
+
+# The asyncio API needs Python 3.7 or later
+if sys.version_info >= (3, 7):
+    print('testing asyncio api')
+    import asyncio
+    env_name = 'MiniGrid-PutNear-6x6-N2-v0'
+    num_envs = 4
+    all_actions = [[random.randint(0, 5) for i in range(0, num_envs)] for step in range(0, 100)]
+    async def run_pools(pools):
+        async def run(pool):
+            results = [await pool.areset()]
+            for actions in all_actions:
+                results.append(await pool.astep(actions))
+            return results
+        return await asyncio.gather(*[run(pool) for pool in pools])
+    pools = [ThreadVecEnv(env_name, num_envs, num_workers=2, seed=9) for i in range(0, 2)]
+    results = asyncio.run(run_pools(pools))
+    vec_env = ThreadVecEnv(env_name, num_envs, num_workers=2, seed=9)
+    expected = [vec_env.reset()] + [vec_env.step(actions) for actions in all_actions]
+    for pool, pool_results in zip(pools, results):
+        assert np.array_equal(pool_results[0]['image'], expected[0]['image'])
+        for (obs, rewards, dones, _), (vec_obs, vec_rewards, vec_dones, _) in zip(pool_results[1:], expected[1:]):
+            assert np.array_equal(obs['image'], vec_obs['image'])
+            assert np.array_equal(rewards, vec_rewards) and np.array_equal(dones, vec_dones)
+        pool.close()
+    vec_env.close()
+    env = gym.make(env_name)
+    env.seed(9)
+    obs = asyncio.run(env.areset())
+    obs, reward, done, info = asyncio.run(env.astep(env.actions.forward))
+    env.seed(9)
+    env.reset()
+    assert np.array_equal(obs['image'], env.step(env.actions.forward)[0]['image'])
+
+print('testing lazy observations')
+from gym_minigrid.minigrid import LazyObs
+for env_name in ['MiniGrid-PutNear-6x6-N2-v0', 'MiniGrid-Fetch-5x5-N2-v0', 'MiniGrid-Dynamic-Obstacles-6x6-v0']:
+    env = gym.make(env_name)
+    lazy_env = gym.make(env_name)
+    lazy_env.lazy_obs = True
+    env.seed(3)
+    lazy_env.seed(3)
+    env.reset()
+    lazy_env.reset()
+    for step in range(0, 200):
+        action = random.randint(0, 5)
+        obs, reward, done, _ = env.step(action)
+        lazy_obs, lazy_reward, lazy_done, _ = lazy_env.step(action)
+        assert isinstance(lazy_obs, LazyObs)
+        assert reward == lazy_reward and done == lazy_done
+        if step % 2 == 0:
+            assert np.array_equal(obs['image'], lazy_obs['image'])
+            assert obs['direction'] == lazy_obs['direction']
+            assert obs['mission'] == lazy_obs['mission']
+        if done:
+            env.reset()
+            lazy_env.reset()
+env = gym.make('MiniGrid-Empty-5x5-v0')
+env.lazy_obs = True
+env.reset()
+obs, _, _, _ = env.step(env.actions.left)
+env.step(env.actions.left)
+try:
+    obs['image']
+    assert False, 'expired observation was read'
+except RuntimeError:
+    pass
+
+print('testing step_many')
+for env_name in ['MiniGrid-Dynamic-Obstacles-6x6-v0', 'MiniGrid-PutNear-6x6-N2-v0']:
+    env = gym.make(env_name)
+    many_env = gym.make(env_name)
+    env.seed(5)
+    many_env.seed(5)
+    env.reset()
+    many_env.reset()
+    for i in range(0, 50):
+        actions = [random.randint(0, 5) for j in range(0, random.randint(1, 8))]
+        rewards = []
+        dones = []
+        for action in actions:
+            obs, reward, done, _ = env.step(action)
+            rewards.append(reward)
+            dones.append(done)
+            if done:
+                break
+        many_obs, many_rewards, many_dones, _ = many_env.step_many(actions)
+        assert np.array_equal(obs['image'], many_obs['image'])
+        assert list(many_rewards) == rewards and list(many_dones) == dones
+        if done:
+            env.reset()
+            many_env.reset()
+
+# Only the last observation of step_many is generated
+env = gym.make('MiniGrid-Dynamic-Obstacles-6x6-v0').unwrapped
+env.seed(5)
+env.reset()
+num_images = [0]
+gen_obs_image = env.gen_obs_image
+def counting_gen_obs_image():
+    num_images[0] += 1
+    return gen_obs_image()
+env.gen_obs_image = counting_gen_obs_image
+_, _, many_dones, _ = env.step_many([env.actions.left] * 8)
+assert len(many_dones) == 8 and not any(many_dones)
+assert num_images[0] == 1
+env_name = 'MiniGrid-DoorKey-5x5-v0'
+num_envs = 4
+vec_env = VecMiniGrid(env_name, num_envs, seed=8)
+thread_env = ThreadVecEnv(env_name, num_envs, num_workers=2, seed=8)
+vec_env.reset()
+thread_env.reset()
+for i in range(0, 50):
+    actions = np.random.randint(0, 6, size=(random.randint(1, 8), num_envs))
+    vec_obs, vec_rewards, vec_dones, vec_infos = vec_env.step_many(actions)
+    obs, rewards, dones, infos = thread_env.step_many(actions)
+    assert np.array_equal(vec_obs['image'], obs['image'])
+    assert np.array_equal(vec_rewards, rewards) and np.array_equal(vec_dones, dones)
+    for j in np.flatnonzero(dones.any(axis=0)):
+        assert np.array_equal(vec_infos[j]['terminal_image'], infos[j]['terminal_image'])
+vec_env.close()
+thread_env.close()
+
+print('testing step action types')
+env = gym.make('MiniGrid-Empty-8x8-v0')
+other_env = gym.make('MiniGrid-Empty-8x8-v0')
+env.reset()
+other_env.reset()
+for i in range(0, 100):
+    action = random.randint(0, 6)
+    obs, reward, done, _ = env.step(action)
+    other_obs, other_reward, other_done, _ = other_env.step(np.int64(action))
+    assert np.array_equal(obs['image'], other_obs['image'])
+    assert reward == other_reward and done == other_done
+    assert type(env.agent_pos[0]) is int and type(env.agent_dir) is int
+    if done:
+        env.reset()
+        other_env.reset()
+
+print('testing binary state serialization')
+for env_name in ['MiniGrid-DoorKey-8x8-v0', 'MiniGrid-PutNear-6x6-N2-v0', 'MiniGrid-Dynamic-Obstacles-6x6-v0']:
+    env = gym.make(env_name)
+    env.seed(11)
+    env.reset()
+    for i in range(0, 20):
+        env.step(random.randint(0, 5))
+    blob = env.get_state()
+    assert isinstance(blob, bytes)
+    actions = [random.randint(0, 5) for i in range(0, 50)]
+    def run(env):
+        results = []
+        for action in actions:
+            obs, reward, done, _ = env.step(action)
+            results.append((obs['image'], reward, done, env.state_hash()))
+            if done:
+                env.reset()
+        return results
+    results = run(env)
+    other_env = gym.make(env_name)
+    other_env.set_state(blob)
+    for (image, reward, done, h), (other_image, other_reward, other_done, other_h) in zip(results, run(other_env)):
+        assert np.array_equal(image, other_image)
+        assert reward == other_reward and done == other_done and h == other_h
+
+# Restoring the level of another seed restores all its attributes
+level_envs = [
+    'MiniGrid-MultiRoom-N4-S5-v0',
+    'MiniGrid-LockedRoom-v0',
+    'MiniGrid-GoToDoor-5x5-v0',
+    'MiniGrid-GoToObject-6x6-N2-v0',
+    'MiniGrid-Fetch-5x5-N2-v0',
+    'MiniGrid-PutNear-6x6-N2-v0',
+    'MiniGrid-RedBlueDoors-6x6-v0',
+    'MiniGrid-MemoryS7-v0',
+    'MiniGrid-Dynamic-Obstacles-6x6-v0',
+    'MiniGrid-KeyCorridorS6R3-v0',
+    'MiniGrid-ObstructedMaze-2Dlh-v0',
+]
+level_skip = (
+    'np_random', 'action_space', 'observation_space', 'grid', 'grid_render',
+    'obs_render', 'level_cache', 'reset_seed', '_obs_grid', '_obs_key',
+    '_obs_image', '_handlers'
+)
+class LevelPickler(pickle.Pickler):
+    # Objects of the grid are pickled as their cell, so that references
+    # to them from the attributes also have to match
+    def __init__(self, file, grid):
+        super().__init__(file)
+        self.cells = {id(obj): idx for idx, obj in grid.objs.items()}
+    def persistent_id(self, obj):
+        return self.cells.get(id(obj))
+def level_attrs(env):
+    env = env.unwrapped
+    objs = [(idx, pickle.dumps(obj)) for idx, obj in sorted(env.grid.objs.items())]
+    attrs = {}
+    for name, value in vars(env).items():
+        if name not in level_skip:
+            buf = io.BytesIO()
+            LevelPickler(buf, env.grid).dump(value)
+            attrs[name] = buf.getvalue()
+    return env.grid.array.tobytes(), objs, attrs
+for env_name in level_envs:
+    env = gym.make(env_name)
+    other_env = gym.make(env_name)
+    env.seed(1)
+    env.reset()
+    other_env.seed(2)
+    other_env.reset()
+    other_state = other_env.unwrapped.clone_state()
+    other_env.set_state(env.get_state())
+    assert level_attrs(other_env) == level_attrs(env)
+    state = env.unwrapped.clone_state()
+    env.unwrapped.restore_state(other_state)
+    assert level_attrs(env) != level_attrs(other_env)
+    env.unwrapped.restore_state(state)
+    assert level_attrs(env) == level_attrs(other_env)
+
+future_blob = bytearray(blob)
+future_blob[3] = 255
+try:
+    env.set_state(bytes(future_blob))
+    assert False, 'unsupported state version was accepted'
+except ValueError:
+    pass
+
+# Pickled states can only reference world objects and state classes
+from gym_minigrid.minigrid import STATE_HEADER, STATE_AGENT, STATE_RNG
+env = gym.make('MiniGrid-DoorKey-5x5-v0').unwrapped
+env.reset()
+blob = env.get_state()
+offset = STATE_HEADER.size + env.width * env.height * 3 + STATE_AGENT.size + STATE_RNG.size + 624 * 4
+class UnsafeValue:
+    def __reduce__(self):
+        return (print, ('unpickled an unsafe value',))
+try:
+    env.set_state(blob[:offset] + pickle.dumps(([], {'mission': UnsafeValue()})))
+    assert False, 'unsafe state was accepted'
+except pickle.UnpicklingError:
+    pass
+
+print('testing level cache')
+from gym_minigrid.wrappers import ReseedWrapper
+env = ReseedWrapper(gym.make('MiniGrid-MultiRoom-N4-S5-v0'), seeds=[1, 2, 3], level_cache=None)
+cached_env = ReseedWrapper(gym.make('MiniGrid-MultiRoom-N4-S5-v0'), seeds=[1, 2, 3])
+for episode in range(0, 9):
+    obs = env.reset()
+    cached_obs = cached_env.reset()
+    assert np.array_equal(obs['image'], cached_obs['image'])
+    for i in range(0, 20):
+        action = random.randint(0, 5)
+        obs, reward, done, _ = env.step(action)
+        cached_obs, cached_reward, cached_done, _ = cached_env.step(action)
+        assert np.array_equal(obs['image'], cached_obs['image'])
+        assert reward == cached_reward and done == cached_done
+        assert env.unwrapped.state_hash() == cached_env.unwrapped.state_hash()
+cache = cached_env.unwrapped.level_cache
+assert len(cache) == 3 and cache.misses == 3 and cache.hits == 6
+
+# Cached levels have every attribute of a freshly generated level
+for env_name in level_envs:
+    cached_env = ReseedWrapper(gym.make(env_name), seeds=[1, 2])
+    env = gym.make(env_name)
+    for episode in range(0, 4):
+        cached_env.reset()
+        env.seed(1 + episode % 2)
+        env.reset()
+        assert level_attrs(cached_env) == level_attrs(env)
+    assert cached_env.unwrapped.level_cache.hits == 2
+
+print('testing level prefetching')
+env_name = 'MiniGrid-MultiRoom-N2-S4-v0'
+num_envs = 3
+vec_env = ThreadVecEnv(env_name, num_envs, num_workers=1, seed=20, prefetch=2)
+envs = [gym.make(env_name) for i in range(0, num_envs)]
+episodes = [1] * num_envs
+for i, env in enumerate(envs):
+    env.seed(20 + i)
+    env.reset()
+vec_env.reset()
+for step in range(0, 200):
+    actions = [random.randint(0, 2) for i in range(0, num_envs)]
+    vec_obs, vec_rewards, vec_dones, _ = vec_env.step(actions)
+    for i, env in enumerate(envs):
+        obs, reward, done, _ = env.step(actions[i])
+        assert done == vec_dones[i] and reward == vec_rewards[i]
+        if done:
+            # Episode k of environment i uses the seed 20 + i + k * num_envs
+            env.seed(20 + i + episodes[i] * num_envs)
+            episodes[i] += 1
+            obs = env.reset()
+        assert np.array_equal(obs['image'], vec_obs['image'][i])
+vec_env.close()
+# Instance configuration changing the levels is used by the prefetcher
+from gym_minigrid.prefetch import LevelPrefetcher
+env = gym.make('MiniGrid-MultiRoom-N6-v0').unwrapped
+env.compat_placement = False
+prefetcher = LevelPrefetcher(env, [range(10, 15)])
+env.prefetcher = prefetcher
+other_env = gym.make('MiniGrid-MultiRoom-N6-v0').unwrapped
+other_env.compat_placement = False
+for seed in range(10, 15):
+    env.reset()
+    other_env.seed(seed)
+    other_env.reset()
+    assert env.grid == other_env.grid
+prefetcher.close()
+
+print('testing level bank')
+import os
+import tempfile
+from gym_minigrid.levelbank import build_level_bank, LevelBank, LevelBankWrapper
+bank_dir = tempfile.mkdtemp()
+bank_envs = [
+    'MiniGrid-MultiRoom-N4-S5-v0',
+    'MiniGrid-Fetch-5x5-N2-v0',
+    'MiniGrid-MemoryS7-v0',
+    'MiniGrid-Dynamic-Obstacles-6x6-v0',
+    'MiniGrid-KeyCorridorS6R3-v0',
+    'MiniGrid-ObstructedMaze-Full-v0',
+]
+for env_name in bank_envs:
+    path = os.path.join(bank_dir, 'levels.bank')
+    build_level_bank(env_name, path, 100, 50, num_workers=2, chunk_size=16)
+    bank = LevelBank(path)
+    assert len(bank) == 50 and bank.env_id == env_name
+    env = gym.make(env_name)
+    bank_env = LevelBankWrapper(gym.make(env_name), bank, seeds=[101, 120, 149])
+    for seed in [101, 120, 149]:
+        env.seed(seed)
+        obs = env.reset()
+        bank_obs = bank_env.reset()
+        assert bank_env.level_seed == seed
+        assert np.array_equal(obs['image'], bank_obs['image'])
+        assert obs['mission'] == bank_obs['mission']
+        # Objects are created from their encoding, without their
+        # positions, so only the planes and the attributes are compared
+        assert level_attrs(env)[::2] == level_attrs(bank_env)[::2]
+        assert env.unwrapped.state_hash() == bank_env.unwrapped.state_hash()
+        rng_state = env.unwrapped.np_random.get_state()
+        bank_rng_state = bank_env.unwrapped.np_random.get_state()
+        assert np.array_equal(rng_state[1], bank_rng_state[1])
+        assert rng_state[2:] == bank_rng_state[2:]
+        for i in range(0, 50):
+            action = random.randint(0, 5)
+            obs, reward, done, _ = env.step(action)
+            bank_obs, bank_reward, bank_done, _ = bank_env.step(action)
+            assert np.array_equal(obs['image'], bank_obs['image'])
+            assert reward == bank_reward and done == bank_done
+            if done:
+                break
+    os.remove(path)
+os.rmdir(bank_dir)
+
+print('testing object placement')
+from gym_minigrid.minigrid import Grid, Wall
+def place_reference(env, rng, top, size, reject_fn):
+    # Rejection sampling, as place_obj was first implemented
+    while True:
+        pos = np.array((rng.randint(top[0], top[0] + size[0]), rng.randint(top[1], top[1] + size[1])))
+        if env.grid.get(*pos) != None or np.array_equal(pos, env.agent_pos):
+            continue
+        if reject_fn and reject_fn(env, pos):
+            continue
+        return pos
+env = gym.make('MiniGrid-Empty-16x16-v0').unwrapped
+for seed in range(0, 20):
+    env.seed(seed)
+    env.reset()
+    for i in range(0, 100):
+        env.grid.set(env._rand_int(1, 15), env._rand_int(1, 15), Wall())
+    rng = np.random.RandomState()
+    rng.set_state(env.np_random.get_state())
+    reject_fn = lambda env, pos: pos[0] == pos[1]
+    for i in range(0, 10):
+        pos = place_reference(env, rng, (2, 3), (10, 12), reject_fn)
+        assert np.array_equal(env.place_obj(Ball(), (2, 3), (10, 12), reject_fn), pos)
+# Sampling among the free cells only, and failing when there are none
+env.grid = Grid(16, 16)
+env.grid.fill_rect(0, 0, 16, 16, Wall())
+env.grid.set(5, 7, None)
+env.grid.set(12, 3, None)
+env.agent_pos = (12, 3)
+for compat_placement in [True, False]:
+    env.compat_placement = compat_placement
+    assert tuple(env.place_obj(None)) == (5, 7)
+    env.grid.set(5, 7, Wall())
+    try:
+        env.place_obj(Ball())
+        assert False, 'object placed on an occupied cell'
+    except RecursionError:
+        pass
+    env.grid.set(5, 7, None)
+
+print('testing multi-room layouts')
+from gym_minigrid.minigrid import RandIntStream
+env = gym.make('MiniGrid-MultiRoom-N6-v0').unwrapped
+other_env = gym.make('MiniGrid-MultiRoom-N6-v0').unwrapped
+env.seed(3)
+other_env.seed(3)
+bounds = [(0, 1), (0, 3), (-5, 20), (7, 8), (0, 1000)] * 200
+with RandIntStream(env, chunk_size=16):
+    values = [env._rand_int(low, high) for low, high in bounds]
+assert values == [other_env._rand_int(low, high) for low, high in bounds]
+assert env.np_random.randint(0, 1000) == other_env.np_random.randint(0, 1000)
+# Without compatibility, rooms are chained by doors and don't overlap
+env.compat_placement = False
+for seed in range(0, 50):
+    env.seed(seed)
+    env.reset()
+    assert len(env.rooms) == 6 and env.layout_restarts >= 0
+    assert env.grid.count('door') == 5
+    for idx, room in enumerate(env.rooms):
+        (topX, topY), (sizeX, sizeY) = room.top, room.size
+        assert topX >= 0 and topY >= 0
+        assert topX + sizeX <= env.width and topY + sizeY <= env.height
+        for other in env.rooms[:max(idx - 1, 0)]:
+            assert topX >= other.top[0] + other.size[0] or other.top[0] >= topX + sizeX or \
+                topY >= other.top[1] + other.size[1] or other.top[1] >= topY + sizeY
+        if idx > 0:
+            assert env.grid.get(*room.entryDoorPos).type == 'door'
+
+print('testing room connectivity')
+from gym_minigrid.roomgrid import RoomSets
+room_sets = RoomSets(6)
+assert room_sets.union(0, 1) and room_sets.union(2, 3) and room_sets.union(1, 3)
+assert not room_sets.union(0, 2)
+assert room_sets.connected(0, 3) and not room_sets.connected(0, 4)
+assert room_sets.num_sets == 3
+for compat_placement in [True, False]:
+    env = gym.make('MiniGrid-KeyCorridorS6R3-v0').unwrapped
+    env.compat_placement = compat_placement
+    for seed in range(0, 20):
+        env.seed(seed)
+        env.reset()
+        assert env.room_sets.num_sets == 1
+        # Every room is reachable through doors and removed walls
+        reach = set()
+        stack = [env.room_from_pos(*env.agent_pos)]
+        while stack:
+            room = stack.pop()
+            if room not in reach:
+                reach.add(room)
+                stack.extend(room.neighbors[k] for k in range(0, 4) if room.doors[k])
+        assert len(reach) == env.num_rows * env.num_cols
+
+##############################################################################
+
+# The checks of every registered environment run last, so that a failing
+# environment does not hide the results of the sections above
 print('%d environments registered' % len(env_list))
 
 for env_name in env_list:
@@ -54,6 +759,10 @@ for env_name in env_list:
         img2 = Grid.decode(img).encode(vis_mask=vis_mask)
         assert np.array_equal(img, img2)
 
+        # Test decoding a stack of observations
+        img3 = Grid.decode(np.stack([img, img]))[1].encode(vis_mask=vis_mask)
+        assert np.array_equal(img, img3)
+
         # Test the env to string function
         str(env)
 
@@ -102,26 +811,3 @@ for env_name in env_list:
     env.reset()
     env.step(0)
     env.close()
-
-##############################################################################
-
-print('testing agent_sees method')
-env = gym.make('MiniGrid-DoorKey-6x6-v0')
-goal_pos = (env.grid.width - 2, env.grid.height - 2)
-
-# Test the "in" operator on grid objects
-assert ('green', 'goal') in env.grid
-assert ('blue', 'key') not in env.grid
-
-# Test the env.agent_sees() function
-env.reset()
-for i in range(0, 500):
-    action = random.randint(0, env.action_space.n - 1)
-    obs, reward, done, info = env.step(action)
-    goal_visible = ('green', 'goal') in Grid.decode(obs['image'])
-    agent_sees_goal = env.agent_sees(*goal_pos)
-    assert agent_sees_goal == goal_visible
-    if done:
-        env.reset()
-
-#############################################################################